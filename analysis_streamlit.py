@@ -3,20 +3,64 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 from datetime import datetime
+from src.analysis import history_queries
+from src.analysis.history_loader import HistoryLoader
+from src.bot.database import count_games, load_player_stats
+from src.bot.game_history import history_formats
+from src.config.settings import HISTORY_CSV_PATH, HISTORY_PARQUET_DIR
 
+# Seconds between checks for games the bot wrote since the page was drawn
+HISTORY_REFRESH_SECONDS = 1
 
-def load_data(file_path='archive/games.csv'):
-    """Load and preprocess the game data"""
+
+def default_history_path():
+    """Parquet history directory if the bot writes one, games.csv otherwise"""
+    if 'parquet' in history_formats() and os.path.isdir(HISTORY_PARQUET_DIR):
+        return HISTORY_PARQUET_DIR
+    return HISTORY_CSV_PATH
+
+
+@st.cache_resource
+def get_history_loader():
+    """One loader shared by every browser session of this dashboard process"""
+    return HistoryLoader()
+
+
+def load_data(file_path=None):
+    """Load and preprocess the game data
+
+    Only the part of the history written since the last call is parsed, so
+    this is cheap to call on every rerun and new games show up right away.
+    """
+    file_path = file_path or default_history_path()
     try:
-        df = pd.read_csv(file_path)
-        df['timestamp'] = pd.to_datetime(df['timestamp'],
-                                         format='%Y%m%d-%H%M%S')
-        return df
+        return get_history_loader().load(file_path)
     except Exception as e:
         raise Exception(f"Error loading data: {str(e)}")
 
 
+def history_version(use_database):
+    """Changes whenever the bot records a game"""
+    if use_database:
+        return count_games(short_lived=True)
+    # Appending to games.csv or adding a game file to the Parquet directory
+    # both move the mtime
+    return os.stat(default_history_path()).st_mtime_ns
+
+
+@st.fragment(run_every=HISTORY_REFRESH_SECONDS)
+def watch_history(use_database, shown_version):
+    """Redraw the page once games newer than the ones shown were recorded"""
+    try:
+        version = history_version(use_database)
+    except OSError:
+        return
+    if version != shown_version:
+        st.rerun()
+
+
 def plot_winrates(data, players):
     """
     Plot winrates vs total games played for selected players.
@@ -75,50 +119,141 @@ def plot_winrates(data, players):
     return fig
 
 
-def calculate_player_stats(data, player):
-    """Calculate detailed statistics for a player"""
-    player_games = data[data['nickname'] == player]
+ROLE_ORDER = ['tank', 'dps', 'support']
 
-    total_games = len(player_games)
-    wins = len(player_games[player_games['result'] == 1])
-    win_rate = (wins / total_games) * 100 if total_games > 0 else 0
 
-    role_stats = player_games['role'].value_counts()
-    roles_list = []
-    for role, count in role_stats.items():
-        roles_list.append(f"{role}: {count}")
-    roles = ', '.join(roles_list)
+def calculate_player_stats(data, players):
+    """Calculate detailed statistics for all players in one grouped pass
 
-    captain_filter = player_games['captain'] == True
-    captain_games = len(player_games[captain_filter])
+    Args:
+        data (pd.DataFrame): History rows, already filtered
+        players (list): Player nicknames, in the order they should be listed
+
+    Returns:
+        pd.DataFrame: One row per player that has games in data
+    """
+    player_games = data[data['nickname'].isin(players)]
+    if len(player_games) == 0:
+        return pd.DataFrame()
+
+    grouped = player_games.groupby('nickname')
+    totals = grouped.agg(total_games=('result', 'size'),
+                         wins=('result', 'sum'),
+                         captain_games=('captain', 'sum'))
+
+    role_counts = (player_games.groupby(['nickname', 'role']).size()
+                   .reset_index(name='count')
+                   .sort_values(['nickname', 'count'],
+                                ascending=[True, False]))
+    role_labels = role_counts['role'] + ': ' + role_counts['count'].astype(str)
+    roles = role_labels.groupby(role_counts['nickname']).agg(', '.join)
+
+    totals = totals.reindex([p for p in players if p in totals.index])
+    win_rate = totals['wins'] / totals['total_games'] * 100
+
+    return pd.DataFrame({
+        'Player': totals.index,
+        'Total Games': totals['total_games'].to_numpy(),
+        'Wins': totals['wins'].to_numpy(),
+        'Win Rate': win_rate.map('{:.1f}%'.format).to_numpy(),
+        'Roles Played': roles.reindex(totals.index).to_numpy(),
+        'Times as Captain': totals['captain_games'].astype(int).to_numpy()
+    })
+
+
+def recent_games_table(recent_games, selected_players):
+    """Reshape the rows of recent games into one wide row per game
+
+    Args:
+        recent_games (pd.DataFrame): Every history row of the games to show
+        selected_players (list): Players to highlight in bold
+
+    Returns:
+        tuple: (players, info). players has one row per game, newest first,
+            and (team, role, slot) columns holding the display text of the
+            player in that slot. info holds each game's timestamp and winner.
+    """
+    games = recent_games.copy()
+    games['role'] = pd.Categorical(games['role'], categories=ROLE_ORDER,
+                                   ordered=True)
+    games = games.sort_values(['game_id', 'team', 'role', 'nickname'])
+    games['slot'] = games.groupby(['game_id', 'team', 'role'],
+                                  observed=True).cumcount()
+
+    is_selected = games['nickname'].isin(selected_players)
+    name = games['nickname'].where(~is_selected, '**' + games['nickname'] + '**')
+    games['display'] = name + np.where(games['captain'].astype(bool),
+                                       ' (Captain)', '')
+
+    players = games.pivot(index='game_id', columns=['team', 'role', 'slot'],
+                          values='display')
+    players = players.sort_index(axis=1).sort_index(ascending=False)
+
+    info = games.groupby('game_id').agg(timestamp=('timestamp', 'first'))
+    team1_won = games[games['team'] == 'team1'].groupby('game_id')['result'].max()
+    info['winner'] = np.where(team1_won.reindex(info.index) == 1,
+                              'Team 1', 'Team 2')
+    return players, info.reindex(players.index)
+
+
+def format_player_totals(totals):
+    """Turn a player_stats aggregate row into a statistics table row"""
+    total_games = totals['games']
+    wins = totals['wins']
+    win_rate = (wins / total_games) * 100 if total_games > 0 else 0
+
+    role_counts = [(role, totals[f'{role}_games'])
+                   for role in ('tank', 'dps', 'support')]
+    role_counts = sorted((rc for rc in role_counts if rc[1]),
+                         key=lambda rc: rc[1], reverse=True)
+    roles = ', '.join(f"{role}: {count}" for role, count in role_counts)
 
     return {
-        'Player': player,
+        'Player': totals['nickname'],
         'Total Games': total_games,
         'Wins': wins,
         'Win Rate': f"{win_rate:.1f}%",
         'Roles Played': roles,
-        'Times as Captain': captain_games
+        'Times as Captain': totals['captain_games']
     }
 
 
+def filter_history(data, date_range, roles):
+    """Rows of the loaded history inside the date range and roles"""
+    date_mask = data['timestamp'].dt.date >= date_range[0]
+    date_mask = date_mask & (data['timestamp'].dt.date <= date_range[1])
+    role_mask = data['role'].isin(roles)
+    return data[date_mask & role_mask]
+
+
 def main():
     st.title("PUG Statistics Analysis")
 
-    if 'data' not in st.session_state:
+    # The indexed SQLite history answers every filter with a query, the
+    # CSV/Parquet files have to be loaded whole and masked in pandas
+    use_database = history_queries.history_available()
+
+    if not use_database:
         try:
-            st.session_state.data = load_data()
-            st.session_state.all_players = sorted(
-                st.session_state.data['nickname'].unique())
+            shown_version = history_version(use_database)
+            data = load_data()
         except Exception as e:
             st.error(str(e))
             return
+    else:
+        shown_version = history_version(use_database)
+    watch_history(use_database, shown_version)
 
     with st.sidebar:
         st.header("Analysis Controls")
 
-        min_date = st.session_state.data['timestamp'].min()
-        max_date = st.session_state.data['timestamp'].max()
+        if use_database:
+            min_date, max_date = history_queries.date_bounds()
+            role_options = history_queries.list_roles()
+        else:
+            min_date = data['timestamp'].min()
+            max_date = data['timestamp'].max()
+            role_options = sorted(data['role'].unique())
 
         date_range = st.date_input(
             "Date Range",
@@ -129,17 +264,17 @@ def main():
 
         selected_roles = st.multiselect(
             "Filter by Role",
-            options=sorted(st.session_state.data['role'].unique()),
-            default=sorted(st.session_state.data['role'].unique())
+            options=role_options,
+            default=role_options
         )
 
-        date_mask = st.session_state.data['timestamp'].dt.date >= date_range[0]
-        date_mask = date_mask & (
-                    st.session_state.data['timestamp'].dt.date <= date_range[1])
-        role_mask = st.session_state.data['role'].isin(selected_roles)
-        filtered_data = st.session_state.data[date_mask & role_mask]
-
-        available_players = sorted(filtered_data['nickname'].unique())
+        if use_database:
+            available_players = history_queries.list_players(
+                date_range[0], date_range[1], selected_roles)
+        else:
+            filtered_data = filter_history(data, date_range,
+                                           selected_roles)
+            available_players = sorted(filtered_data['nickname'].unique())
 
         selected_players = st.multiselect(
             "Select Players to Analyze",
@@ -153,76 +288,63 @@ def main():
         return
 
     try:
+        if use_database:
+            player_data = history_queries.load_player_rows(
+                date_range[0], date_range[1], selected_roles, selected_players)
+            recent_games = history_queries.load_recent_games(
+                date_range[0], date_range[1], selected_roles, selected_players)
+        else:
+            player_filter = filtered_data['nickname'].isin(selected_players)
+            player_data = filtered_data[player_filter]
+            game_ids = player_data['game_id'].unique()
+            recent_game_ids = sorted(game_ids, reverse=True)[:10]
+            recent_games = filtered_data[
+                filtered_data['game_id'].isin(recent_game_ids)]
+
         st.header("Player Win Rates")
-        fig = plot_winrates(filtered_data, selected_players)
+        fig = plot_winrates(player_data, selected_players)
         if fig:
             st.pyplot(fig)
 
         st.header("Player Statistics")
-        stats = []
-        for player in selected_players:
-            stats.append(calculate_player_stats(filtered_data, player))
-
-        if stats:
-            st.dataframe(pd.DataFrame(stats))
+        unfiltered = (tuple(date_range) == (min_date.date(), max_date.date())
+                      and set(selected_roles) == set(role_options))
+        if use_database and unfiltered:
+            # All-time totals are kept up to date in player_stats
+            totals = load_player_stats(selected_players,
+                                       short_lived=True)
+            stats = pd.DataFrame([format_player_totals(totals[player])
+                                  for player in selected_players
+                                  if player in totals])
+        else:
+            stats = calculate_player_stats(player_data, selected_players)
+
+        if len(stats):
+            st.dataframe(stats)
 
         st.header("Recent Games")
 
-        player_filter = filtered_data['nickname'].isin(selected_players)
-        player_games = filtered_data[player_filter]
-        game_ids = player_games['game_id'].unique()
-        recent_game_ids = sorted(game_ids, reverse=True)[:10]
+        if len(recent_games) > 0:
+            players, info = recent_games_table(recent_games, selected_players)
 
-        if len(recent_game_ids) > 0:
-            recent_games = filtered_data[
-                filtered_data['game_id'].isin(recent_game_ids)]
-
-            for game_id in recent_game_ids:
-                game_data = recent_games[recent_games['game_id'] == game_id]
-                timestamp_str = game_data['timestamp'].iloc[0].strftime(
+            for game_id in players.index:
+                game_players = players.loc[game_id].dropna()
+                timestamp_str = info.at[game_id, 'timestamp'].strftime(
                     '%Y-%m-%d %H:%M')
 
                 with st.expander(f"Game {game_id} - {timestamp_str}"):
                     cols = st.columns(2)
 
-                    with cols[0]:
-                        st.subheader("Team 1")
-                        team1_data = game_data[game_data['team'] == 'team1']
-                        team1_sorted = team1_data.sort_values('role')
-
-                        for role in ['tank', 'dps', 'support']:
-                            role_players = team1_sorted[
-                                team1_sorted['role'] == role]
-                            for _, player in role_players.iterrows():
-                                is_selected = player[
-                                                  'nickname'] in selected_players
-                                highlighted = "**" if is_selected else ""
-                                is_captain = " (Captain)" if player[
-                                    'captain'] else ""
-                                st.write(
-                                    f"{role.upper()}: {highlighted}{player['nickname']}{highlighted}{is_captain}")
-
-                    with cols[1]:
-                        st.subheader("Team 2")
-                        team2_data = game_data[game_data['team'] == 'team2']
-                        team2_sorted = team2_data.sort_values('role')
-
-                        for role in ['tank', 'dps', 'support']:
-                            role_players = team2_sorted[
-                                team2_sorted['role'] == role]
-                            for _, player in role_players.iterrows():
-                                is_selected = player[
-                                                  'nickname'] in selected_players
-                                highlighted = "**" if is_selected else ""
-                                is_captain = " (Captain)" if player[
-                                    'captain'] else ""
-                                st.write(
-                                    f"{role.upper()}: {highlighted}{player['nickname']}{highlighted}{is_captain}")
-
-                    team1_result = \
-                    game_data[game_data['team'] == 'team1'].iloc[0]['result']
-                    winner = "Team 1" if team1_result == 1 else "Team 2"
-                    st.write(f"Winner: {winner}")
+                    for col, team, title in ((cols[0], 'team1', "Team 1"),
+                                             (cols[1], 'team2', "Team 2")):
+                        with col:
+                            st.subheader(title)
+                            if team not in game_players.index:
+                                continue
+                            for (role, _), text in game_players[team].items():
+                                st.write(f"{role.upper()}: {text}")
+
+                    st.write(f"Winner: {info.at[game_id, 'winner']}")
 
     except Exception as e:
         st.error(f"Error generating analysis: {str(e)}")
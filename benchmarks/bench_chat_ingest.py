@@ -0,0 +1,197 @@
+"""Chat ingestion throughput benchmark for PickBot._evaluate_message.
+
+Feeds synthetic Twitch IRC traffic straight into the bot, without a network
+connection, and reports messages per second, the latency of handling each
+websocket frame and allocations. Lines are handled a frame at a time, so
+there is no per-message latency to report.
+
+    python -m benchmarks.bench_chat_ingest --messages 100000 --output benchmarks/results/chat.json
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import tracemalloc
+
+from benchmarks.common import (compare_to_baseline, latency_summary,
+                               quiet_stdout, temporary_database,
+                               write_results)
+from src.bot.queue import ROLE_KEYWORDS
+
+SPAM_LINES = ('PogChamp', 'LUL LUL LUL', 'gg', 'when is the next pug?',
+              'KEKW', 'first', 'can i play', 'monkaS', '!discord',
+              'hello chat how is everyone doing today')
+ADMIN_LINES = ('!status',)
+
+
+def chat_line(username, channel, text):
+    return (f"@badge-info=;color=#1E90FF;display-name={username};"
+            f"mod=0;subscriber=0;user-type= "
+            f":{username}!{username}@{username}.tmi.twitch.tv "
+            f"PRIVMSG #{channel} :{text}")
+
+
+def build_traffic(args, admin, channel):
+    """Build the list of websocket frames to replay.
+
+    Each frame holds between 1 and args.max_lines_per_frame IRC lines, the
+    way Twitch batches busy chats.
+    """
+    rng = random.Random(args.seed)
+    users = [f'viewer{i}' for i in range(args.users)]
+    keywords = list(ROLE_KEYWORDS)
+    kinds = ('join', 'spam', 'admin', 'ping')
+    weights = (args.join_ratio, args.spam_ratio, args.admin_ratio,
+               args.ping_ratio)
+
+    lines = []
+    for _ in range(args.messages):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'join':
+            user = rng.choice(users)
+            keyword = rng.choice(keywords)
+            if rng.random() < 0.3:
+                keyword = keyword.capitalize() + ' '
+            lines.append(chat_line(user, channel, keyword))
+        elif kind == 'spam':
+            lines.append(chat_line(rng.choice(users), channel,
+                                   rng.choice(SPAM_LINES)))
+        elif kind == 'admin':
+            lines.append(chat_line(admin, channel, rng.choice(ADMIN_LINES)))
+        else:
+            lines.append('PING :tmi.twitch.tv')
+
+    frames = []
+    index = 0
+    while index < len(lines):
+        size = rng.randint(1, args.max_lines_per_frame)
+        batch = lines[index:index + size]
+        frames.append(('\r\n'.join(batch) + '\r\n', len(batch)))
+        index += size
+    return frames
+
+
+async def replay(bot, frames, start_command):
+    await bot._evaluate_message(start_command)
+    frame_ns = []
+    started = time.perf_counter_ns()
+    for frame, _ in frames:
+        before = time.perf_counter_ns()
+        await bot._evaluate_message(frame)
+        elapsed = time.perf_counter_ns() - before
+        frame_ns.append(elapsed)
+    total_ns = time.perf_counter_ns() - started
+    return total_ns, frame_ns
+
+
+async def measure_allocations(bot, frames, start_command):
+    await bot._evaluate_message(start_command)
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for frame, _ in frames:
+        await bot._evaluate_message(frame)
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in
+                   snapshot_after.compare_to(snapshot_before, 'filename'))
+    return {
+        'peak_traced_kib': peak / 1024,
+        'retained_kib': retained / 1024,
+        'retained_blocks': sys.getallocatedblocks() - blocks_before,
+    }
+
+
+def run(args):
+    from src.bot.twitch_bot import PickBot
+
+    with temporary_database(), quiet_stdout():
+        bot = PickBot(seed=args.seed, journal_path=None)
+        # Replayed traffic is far faster than real chat, so the per-user
+        # rate limit is off unless asked for
+        bot.chat_filter.rate = args.user_rate
+        bot.chat_filter.burst = args.user_burst
+        admin = sorted(bot.starter_names)[0]
+        start_command = chat_line(admin, bot.channel_name, '!start')
+        frames = build_traffic(args, admin, bot.channel_name)
+        message_count = sum(count for _, count in frames)
+
+        for _ in range(args.warmup):
+            asyncio.run(replay(bot, frames[:1000], start_command))
+
+        best = None
+        for _ in range(args.repeat):
+            total_ns, frame_ns = asyncio.run(
+                replay(bot, frames, start_command))
+            if best is None or total_ns < best[0]:
+                best = (total_ns, frame_ns)
+
+        allocations = {}
+        if not args.skip_allocations:
+            allocations = asyncio.run(
+                measure_allocations(bot, frames, start_command))
+        queued = len(bot.queue.tank | bot.queue.dps | bot.queue.support)
+        filtered = bot.chat_filter.stats
+        bot.priorities.stop()
+
+    total_ns, frame_ns = best
+    frames_summary = latency_summary(frame_ns)
+    results = {
+        'messages': message_count,
+        'frames': len(frames),
+        'players_queued_at_end': queued,
+        'seconds': total_ns / 1e9,
+        'messages_per_sec': message_count / (total_ns / 1e9),
+        'frames_per_sec': len(frames) / (total_ns / 1e9),
+        'frame_p50_us': frames_summary['p50_us'],
+        'frame_p99_us': frames_summary['p99_us'],
+        'frame_max_us': frames_summary['max_us'],
+        # Totals over every pass, including warmup
+        'filter_accepted': filtered.accepted,
+        'filter_duplicates': filtered.duplicates,
+        'filter_rate_limited': filtered.rate_limited,
+    }
+    results.update(allocations)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=50000,
+                        help='IRC lines to generate')
+    parser.add_argument('--users', type=int, default=500,
+                        help='distinct chatters')
+    parser.add_argument('--max-lines-per-frame', type=int, default=5)
+    parser.add_argument('--join-ratio', type=float, default=0.6)
+    parser.add_argument('--spam-ratio', type=float, default=0.38)
+    parser.add_argument('--admin-ratio', type=float, default=0.005)
+    parser.add_argument('--ping-ratio', type=float, default=0.015)
+    parser.add_argument('--user-rate', type=float, default=0,
+                        help='lines per second per chatter, 0 disables the limit')
+    parser.add_argument('--user-burst', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs, the fastest is reported')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-allocations', action='store_true',
+                        help='skip the slower tracemalloc pass')
+    parser.add_argument('--output', help='write the JSON result here')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare with')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('output', 'baseline')}
+    document = write_results('chat_ingest', params, run(args), args.output)
+    if args.baseline:
+        compare_to_baseline(document, args.baseline,
+                            ['messages_per_sec', 'frame_p50_us',
+                             'frame_p99_us'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Team selection scaling benchmark for PickBot.generate_teams.
+
+Fills the queue with synthetic players for every combination of queue size
+and team composition, runs full picks against a temporary database and
+reports the time spent in each stage of the pick.
+
+    python -m benchmarks.bench_team_selection --sizes 10,1000,100000 --compositions 1/2/2,3/4/4
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.common import (compare_to_baseline, quiet_stdout,
+                               temporary_database, write_results)
+from src.bot.queue import ALL_ROLES, DPS, SUPPORT, TANK, QueueState
+
+STAGES = ('priority_fetch', 'sampling', 'rating_fetch', 'balance', 'captains',
+          'priority_reset', 'total')
+
+
+def parse_composition(text):
+    tanks, dps, supports = (int(part) for part in text.split('/'))
+    return tanks, dps, supports
+
+
+def player_roles(rng, args):
+    """Role bitmask for one synthetic player"""
+    roll = rng.random()
+    if roll < args.flex_ratio:
+        return ALL_ROLES
+    single = rng.choices((TANK, DPS, SUPPORT), args.role_weights)[0]
+    if roll < args.flex_ratio + args.overlap_ratio:
+        other = rng.choice([role for role in (TANK, DPS, SUPPORT)
+                            if role != single])
+        return single | other
+    return single
+
+
+def fill_queue(bot, size, args):
+    rng = random.Random(args.seed + size)
+    bot.queue.clear()
+    for i in range(size):
+        bot.queue.join(f'player{i}', player_roles(rng, args))
+    bot.queue.is_active = QueueState.INACTIVE
+    bot.queue.publish()
+
+
+def seed_priorities(names, args):
+    """Give the synthetic players a spread of queue counts and last games"""
+    from src.bot.database import get_pool, initialize_priority_database
+
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    initialize_priority_database()
+    rows = [(name, rng.randint(0, 10),
+             0 if rng.random() < 0.3 else now - rng.randint(0, 60 * 86400))
+            for name in names]
+    with get_pool().transaction() as cursor:
+        cursor.executemany('INSERT OR REPLACE INTO player_priority '
+                           '(nickname, times_queued, last_game_time) '
+                           'VALUES (?, ?, ?)', rows)
+
+
+def bench_case(bot, size, composition, args):
+    from src.bot.priority_cache import PriorityCache
+
+    fill_queue(bot, size, args)
+    bot.priorities.stop()
+    seed_priorities(bot.queue.tank | bot.queue.dps | bot.queue.support, args)
+    # Start cold, so the first pick pays for loading priorities from SQLite
+    bot.priorities = PriorityCache()
+
+    stage_samples = {stage: [] for stage in STAGES}
+    failures = 0
+    for _ in range(args.repeat):
+        bot.games.clear()
+        team1, _, _, _, _ = bot.generate_teams(*composition)
+        if not team1:
+            failures += 1
+        for stage in STAGES:
+            stage_samples[stage].append(
+                bot.last_pick_timings.get(stage, 0) * 1000)
+
+    case = {
+        'queue_size': size,
+        'composition': '/'.join(str(n) for n in composition),
+        'failed_picks': failures,
+    }
+    for stage, samples in stage_samples.items():
+        case[f'{stage}_median_ms'] = statistics.median(samples)
+        case[f'{stage}_max_ms'] = max(samples)
+    return case
+
+
+def run(args):
+    from src.bot.twitch_bot import PickBot
+
+    cases = []
+    with temporary_database(), quiet_stdout():
+        bot = PickBot(seed=args.seed, journal_path=None)
+        for composition in args.compositions:
+            for size in args.sizes:
+                cases.append(bench_case(bot, size, composition, args))
+        bot.priorities.stop()
+    return cases
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000',
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        help='comma separated queue sizes')
+    parser.add_argument('--compositions', default='1/2/2,3/4/4',
+                        type=lambda text: [parse_composition(c) for c in text.split(',')],
+                        help='comma separated tanks/dps/supports per team')
+    parser.add_argument('--flex-ratio', type=float, default=0.15,
+                        help='share of players queued for every role')
+    parser.add_argument('--overlap-ratio', type=float, default=0.25,
+                        help='share of players queued for exactly two roles')
+    parser.add_argument('--role-weights', default='0.2,0.45,0.35',
+                        type=lambda text: [float(w) for w in text.split(',')],
+                        help='tank,dps,support weights for single-role players')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='picks per case, medians are reported')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result here')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare with')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('output', 'baseline')}
+    cases = run(args)
+    results = {'cases': cases}
+    for case in cases:
+        key = f"{case['composition']}@{case['queue_size']}_total_median_ms"
+        results[key] = case['total_median_ms']
+    document = write_results('team_selection', params, results, args.output)
+    if args.baseline:
+        compare_to_baseline(document, args.baseline,
+                            [key for key in results if key != 'cases'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import src.bot.database as database
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1,
+                max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(samples_ns):
+    """p50/p99/max/mean of latency samples, converted to microseconds"""
+    ordered = sorted(samples_ns)
+    if not ordered:
+        return {'p50_us': 0, 'p99_us': 0, 'max_us': 0, 'mean_us': 0}
+    return {
+        'p50_us': percentile(ordered, 50) / 1000,
+        'p99_us': percentile(ordered, 99) / 1000,
+        'max_us': ordered[-1] / 1000,
+        'mean_us': sum(ordered) / len(ordered) / 1000,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def temporary_database():
+    """Point the bot's database helpers at a throwaway SQLite file"""
+    original = database.DB_FILE
+    with tempfile.TemporaryDirectory(prefix='pugpicker-bench-') as tmp:
+        database.DB_FILE = os.path.join(tmp, 'bench.db')
+        try:
+            yield database.DB_FILE
+        finally:
+            # Let queued writes finish before the file disappears
+            database.submit_db(lambda: None).result()
+            database.close_all_pools()
+            database.DB_FILE = original
+
+
+@contextmanager
+def quiet_stdout():
+    """Discard the bot's chat logging so it doesn't dominate the timings"""
+    original = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = original
+
+
+def write_results(name, params, results, output=None):
+    """Print a result document and optionally save it as JSON.
+
+    Args:
+        name (str): Benchmark name
+        params (dict): Parameters the run was made with
+        results (dict): Measured values
+        output (str): File to write, directories are created as needed
+    """
+    document = {
+        'benchmark': name,
+        'timestamp': datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    text = json.dumps(document, indent=2)
+    print(text)
+    if output:
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    return document
+
+
+def compare_to_baseline(document, baseline_path, keys):
+    """Print how the given result keys moved relative to a saved run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared to {baseline_path} "
+          f"(revision {baseline.get('git_revision')}):")
+    for key in keys:
+        old = baseline['results'].get(key)
+        new = document['results'].get(key)
+        if not old or new is None:
+            continue
+        print(f"  {key}: {old:.2f} -> {new:.2f} ({(new - old) / old:+.1%})")
@@ -0,0 +1,114 @@
+import io
+import os
+import threading
+
+import pandas as pd
+
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+
+def _prepare(df):
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format=TIMESTAMP_FORMAT)
+    return df
+
+
+class _CsvState:
+    def __init__(self, identity, offset, mtime_ns, frame):
+        self.identity = identity
+        self.offset = offset  # bytes of the file already parsed
+        self.mtime_ns = mtime_ns
+        self.frame = frame
+
+
+class HistoryLoader:
+    """Process-wide cache of parsed game history files.
+
+    A CSV file is re-parsed only from the byte offset where the last parse
+    stopped, as long as it is the same file (device and inode) and it only
+    grew. Anything else, like a replaced or truncated file, triggers a full
+    reload. For a Parquet directory only the files that are new or changed
+    are read again, and the part files of a session are skipped once the
+    session was compacted into a single file. The returned frames are
+    shared, so callers must not modify them in place.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._csv = {}
+        self._parquet = {}
+
+    def load(self, path):
+        with self._lock:
+            if os.path.isdir(path):
+                return self._load_parquet_dir(path)
+            return self._load_csv(path)
+
+    def _load_csv(self, path):
+        stat = os.stat(path)
+        identity = (stat.st_dev, stat.st_ino)
+        state = self._csv.get(path)
+
+        if state is not None and state.identity == identity:
+            if stat.st_size == state.offset and stat.st_mtime_ns == state.mtime_ns:
+                return state.frame
+            if stat.st_size >= state.offset:
+                return self._append_csv(path, state, stat)
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        # Leave a half-written last line for the next call
+        end = data.rfind(b'\n') + 1
+        frame = _prepare(pd.read_csv(io.BytesIO(data[:end]),
+                                     dtype={'game_id': str}))
+        self._csv[path] = _CsvState(identity, end, stat.st_mtime_ns, frame)
+        return frame
+
+    def _append_csv(self, path, state, stat):
+        with open(path, 'rb') as f:
+            f.seek(state.offset)
+            data = f.read(stat.st_size - state.offset)
+        end = data.rfind(b'\n') + 1
+        state.mtime_ns = stat.st_mtime_ns
+        if end == 0:
+            return state.frame
+
+        dtypes = {column: dtype for column, dtype in state.frame.dtypes.items()
+                  if column != 'timestamp'}
+        appended = _prepare(pd.read_csv(io.BytesIO(data[:end]), header=None,
+                                        names=list(state.frame.columns),
+                                        dtype=dtypes))
+        state.frame = pd.concat([state.frame, appended], ignore_index=True)
+        state.offset += end
+        return state.frame
+
+    def _load_parquet_dir(self, path):
+        cached = self._parquet.get(path, {'files': {}, 'signature': None,
+                                          'frame': None})
+        entries = [entry for entry in os.scandir(path)
+                   if not entry.name.startswith('.')
+                   and entry.name.endswith('.parquet')]
+        # session-<id>.parquet replaces the session-<id>-partNNNN.parquet files
+        compacted = {entry.name[:-len('.parquet')] for entry in entries
+                     if '-part' not in entry.name}
+        files = {}
+        for entry in entries:
+            session, part, _ = entry.name.rpartition('-part')
+            if part and session in compacted:
+                continue
+            stat = entry.stat()
+            key = (stat.st_size, stat.st_mtime_ns)
+            previous = cached['files'].get(entry.path)
+            if previous is not None and previous[0] == key:
+                files[entry.path] = previous
+            else:
+                files[entry.path] = (key, _prepare(pd.read_parquet(entry.path)))
+        if not files:
+            raise FileNotFoundError(f"No parquet history files in {path}")
+
+        signature = tuple((name, files[name][0]) for name in sorted(files))
+        if signature != cached['signature']:
+            frame = pd.concat([files[name][1] for name in sorted(files)],
+                              ignore_index=True)
+            cached = {'files': files, 'signature': signature, 'frame': frame}
+            self._parquet[path] = cached
+        return cached['frame']
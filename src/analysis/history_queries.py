@@ -0,0 +1,92 @@
+import sqlite3
+
+import pandas as pd
+
+from src.bot.database import count_games, get_pool
+
+
+def _placeholders(values):
+    return ','.join('?' * len(values))
+
+
+def _timestamp_bounds(start_date, end_date):
+    """Inclusive timestamp strings covering whole days, matching Game.timestamp"""
+    return (start_date.strftime('%Y%m%d') + '-000000',
+            end_date.strftime('%Y%m%d') + '-235959')
+
+
+def _query(sql, params=()):
+    """Run a read query into a DataFrame on a short-lived connection
+
+    The dashboard runs on a new thread every rerun, so each query opens its
+    own read connection and closes it again instead of pooling one per thread.
+    """
+    with get_pool().read(short_lived=True) as cursor:
+        df = pd.read_sql_query(sql, cursor.connection, params=list(params))
+    if 'timestamp' in df:
+        df['timestamp'] = pd.to_datetime(df['timestamp'],
+                                         format='%Y%m%d-%H%M%S')
+    if 'captain' in df:
+        df['captain'] = df['captain'].astype(bool)
+    return df
+
+
+def history_available():
+    """True when the games tables exist and hold at least one game"""
+    try:
+        return count_games(short_lived=True) > 0
+    except sqlite3.Error:
+        return False
+
+
+def date_bounds():
+    with get_pool().read(short_lived=True) as cursor:
+        cursor.execute('SELECT MIN(timestamp), MAX(timestamp) FROM games')
+        first, last = cursor.fetchone()
+    return (pd.to_datetime(first, format='%Y%m%d-%H%M%S'),
+            pd.to_datetime(last, format='%Y%m%d-%H%M%S'))
+
+
+def list_roles():
+    with get_pool().read(short_lived=True) as cursor:
+        cursor.execute('SELECT DISTINCT role FROM game_players ORDER BY role')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def list_players(start_date, end_date, roles):
+    """Players with at least one game in the date range and roles"""
+    if not roles:
+        return []
+    with get_pool().read(short_lived=True) as cursor:
+        cursor.execute('SELECT DISTINCT nickname FROM game_players '
+                       'WHERE timestamp BETWEEN ? AND ? '
+                       f'AND role IN ({_placeholders(roles)}) '
+                       'ORDER BY nickname',
+                       [*_timestamp_bounds(start_date, end_date), *roles])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def load_player_rows(start_date, end_date, roles, players):
+    """History rows of the given players, filtered by date range and roles"""
+    return _query('SELECT game_id, nickname, role, timestamp, team, captain, '
+                  'result FROM game_players '
+                  f'WHERE nickname IN ({_placeholders(players)}) '
+                  'AND timestamp BETWEEN ? AND ? '
+                  f'AND role IN ({_placeholders(roles)})',
+                  [*players, *_timestamp_bounds(start_date, end_date), *roles])
+
+
+def load_recent_games(start_date, end_date, roles, players, limit=10):
+    """Every (role filtered) row of the last games any of the players was in"""
+    bounds = _timestamp_bounds(start_date, end_date)
+    return _query('SELECT game_id, nickname, role, timestamp, team, captain, '
+                  'result FROM game_players '
+                  'WHERE game_id IN ('
+                  '    SELECT game_id FROM game_players '
+                  f'    WHERE nickname IN ({_placeholders(players)}) '
+                  '    AND timestamp BETWEEN ? AND ? '
+                  f'    AND role IN ({_placeholders(roles)}) '
+                  '    GROUP BY game_id ORDER BY MAX(timestamp) DESC LIMIT ?) '
+                  'AND timestamp BETWEEN ? AND ? '
+                  f'AND role IN ({_placeholders(roles)})',
+                  [*players, *bounds, *roles, limit, *bounds, *roles])
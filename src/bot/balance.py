@@ -0,0 +1,85 @@
+"""Rating balanced team splits.
+
+Balancing runs after the players of every role are picked. It only decides
+which of them play on team 1, and every role keeps the same number of players
+on both teams. Among all such splits the one with the smallest difference in
+average rating wins.
+"""
+import bisect
+import itertools
+import math
+
+# Up to this many splits every one is tried, C(2,1)*C(4,2)*C(4,2) = 72 for 5v5
+BRUTE_FORCE_LIMIT = 5000
+
+
+def _role_splits(players, per_team, ratings):
+    """Every choice of per_team players of one role for team 1, with their rating sum"""
+    return [(sum(ratings[player] for player in chosen), chosen)
+            for chosen in itertools.combinations(players, per_team)]
+
+
+def _closest_split(splits, target):
+    """Meet in the middle: the role with the most splits is matched by bisection
+
+    All combinations of the other roles are enumerated, and for each one the
+    sorted rating sums of the remaining role are searched for the value that
+    brings team 1 closest to the target.
+    """
+    right_index = max(range(len(splits)), key=lambda i: len(splits[i]))
+    right = sorted(splits[right_index], key=lambda split: split[0])
+    right_sums = [rating_sum for rating_sum, _ in right]
+    others = [role_splits for i, role_splits in enumerate(splits)
+              if i != right_index]
+
+    best, best_error = None, math.inf
+    for left in itertools.product(*others):
+        left_sum = sum(rating_sum for rating_sum, _ in left)
+        position = bisect.bisect_left(right_sums, target - left_sum)
+        for candidate in right[max(position - 1, 0):position + 1]:
+            error = abs(left_sum + candidate[0] - target)
+            if error < best_error:
+                best_error = error
+                best = left[:right_index] + (candidate,) + left[right_index:]
+    return best
+
+
+def balance_teams(selected, per_team, ratings):
+    """Split the picked players into the two most evenly rated teams.
+
+    When all ratings are equal the first half of each role goes to team 1,
+    the same split as without balancing.
+
+    Args:
+        selected (dict): Role -> players picked for that role, for both teams
+        per_team (dict): Role -> number of players of that role on each team
+        ratings (dict): Player -> rating, must cover every selected player
+
+    Returns:
+        tuple: (team_1, team_2, team_1_average, team_2_average), the teams
+            are role -> list of players dicts
+    """
+    roles = list(selected)
+    splits = [_role_splits(selected[role], per_team[role], ratings)
+              for role in roles]
+    total = sum(ratings[player] for role in roles for player in selected[role])
+    target = total / 2
+
+    if math.prod(len(role_splits) for role_splits in splits) <= BRUTE_FORCE_LIMIT:
+        best = min(itertools.product(*splits),
+                   key=lambda combination: abs(
+                       sum(rating_sum for rating_sum, _ in combination) - target))
+    else:
+        best = _closest_split(splits, target)
+
+    team_1 = {}
+    team_2 = {}
+    for role, (_, chosen) in zip(roles, best):
+        team_1[role] = list(chosen)
+        team_2[role] = [player for player in selected[role]
+                        if player not in chosen]
+
+    team_size = sum(per_team.values())
+    team_1_sum = sum(rating_sum for rating_sum, _ in best)
+    return (team_1, team_2, team_1_sum / team_size,
+            (total - team_1_sum) / team_size)
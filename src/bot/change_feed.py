@@ -0,0 +1,61 @@
+import itertools
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    """One change, numbered with the version it produced"""
+    version: int
+    kind: str
+    data: dict = field(default_factory=dict)
+
+
+class ChangeFeed:
+    """Ordered stream of change events that any thread can follow.
+
+    The producer appends events with strictly increasing versions. Readers
+    remember the last version they saw and ask for everything after it,
+    either right away with since() or by blocking in wait(). Only the most
+    recent max_events are kept, a reader that fell further behind gets None
+    and has to start over from a full snapshot.
+    """
+
+    def __init__(self, max_events=10000):
+        self._events = deque(maxlen=max_events)
+        self._changed = threading.Condition()
+        self.version = 0
+
+    def extend(self, events):
+        """Append events (in version order) and wake up every waiting reader"""
+        if not events:
+            return
+        with self._changed:
+            self._events.extend(events)
+            self.version = events[-1].version
+            self._changed.notify_all()
+
+    def since(self, version):
+        """Events newer than version, oldest first
+
+        Returns:
+            list or None: The events, None if some of them were already dropped
+        """
+        with self._changed:
+            if version >= self.version:
+                return []
+            if not self._events or self._events[0].version > version + 1:
+                return None
+            # Versions are consecutive, so the position follows from the first one
+            start = version + 1 - self._events[0].version
+            return list(itertools.islice(self._events, start, None))
+
+    def wait(self, version, timeout=None):
+        """Block until there are events newer than version, then return them like since()
+
+        Returns an empty list if the timeout passed first.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+        return self.since(version)
@@ -0,0 +1,139 @@
+"""Cheap per-user checks on raw chat lines, before they are parsed.
+
+Two things are dropped here:
+- A line repeating, character for character, the last join the same user
+  sent in the same queue epoch (see Queue.epoch). Joining again could not
+  change anything, so copy-paste spam never reaches the parser.
+- Keyword lines over a user's token bucket: each user gets burst of them
+  at once and rate more per second after that. Only lines whose text is
+  one of the keywords (the role keywords) use up tokens, so ordinary chat
+  never costs a viewer their next join. Exempt users (the admins) are
+  never limited.
+
+Only the nickname and the part after the IRCv3 tags are looked at. Tags
+change with every line (message id, timestamp), the rest of a repeated
+line does not.
+"""
+import time
+from dataclasses import dataclass
+
+# Past this many tracked users, the idle ones are forgotten
+MAX_TRACKED_USERS = 50000
+
+
+@dataclass
+class FilterStats:
+    """Counters of the chat pre-filter, read by the GUI thread"""
+    accepted: int = 0
+    duplicates: int = 0
+    rate_limited: int = 0
+
+
+def _split(line):
+    """(nickname, line without tags) of a chat line, None for anything else"""
+    rest = line.partition(' ')[2] if line[:1] == '@' else line
+    if rest[:1] != ':':
+        return None
+    bang = rest.find('!')
+    if bang < 0 or ' PRIVMSG ' not in rest:
+        return None
+    return rest[1:bang].lower(), rest
+
+
+class ChatFilter:
+    """Join deduplication and per-user rate limit for one bot.
+
+    Args:
+        rate (float): Lines per second a user may send, 0 turns the rate
+            limit off
+        burst (int): Lines a user may send at once
+        exempt (set): Nicknames that are never rate limited
+        keywords (set): Lowercase message texts that are rate limited, None
+            limits every chat line
+    """
+
+    def __init__(self, rate=1.0, burst=5, exempt=(), keywords=None,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = exempt
+        self.keywords = keywords
+        self.clock = clock
+        self.stats = FilterStats()
+        # nickname -> (line without tags, queue epoch) of their last join
+        self._last_join = {}
+        # nickname -> [tokens, time they were counted]
+        self._buckets = {}
+
+    def admit(self, line, epoch):
+        """Check a raw IRC line before it is parsed
+
+        Returns:
+            str or None: None if the line is dropped, otherwise the line to
+                parse. Chat lines come back without their tags, which
+                nothing reads, so parsing them is cheaper too.
+        """
+        split = _split(line)
+        if split is None:
+            return line
+        nickname, rest = split
+        if self._last_join.get(nickname) == (rest, epoch):
+            self.stats.duplicates += 1
+            return None
+        if (self.rate and nickname not in self.exempt
+                and self._is_keyword(rest)):
+            if not self._take_token(nickname):
+                self.stats.rate_limited += 1
+                return None
+        self.stats.accepted += 1
+        return rest
+
+    def _is_keyword(self, rest):
+        if self.keywords is None:
+            return True
+        text = rest.find(' :', rest.find(' PRIVMSG '))
+        return text >= 0 and rest[text + 2:].strip().lower() in self.keywords
+
+    def _take_token(self, nickname):
+        now = self.clock()
+        bucket = self._buckets.get(nickname)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._forget_idle(now)
+            self._buckets[nickname] = [self.burst - 1, now]
+            return True
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def _forget_idle(self, now):
+        """Drop the buckets that have filled up again, they hold no state"""
+        refill = self.burst / self.rate
+        self._buckets = {nickname: bucket
+                         for nickname, bucket in self._buckets.items()
+                         if now - bucket[1] < refill}
+        if len(self._buckets) >= MAX_TRACKED_USERS:
+            # Everyone is active, start over rather than filter on every line
+            self._buckets.clear()
+
+    def remember_join(self, nickname, line, epoch):
+        """Record an accepted join, line as admit() returned it"""
+        if len(self._last_join) >= MAX_TRACKED_USERS:
+            self._last_join = {nickname: last
+                               for nickname, last in self._last_join.items()
+                               if last[1] == epoch}
+            if len(self._last_join) >= MAX_TRACKED_USERS:
+                self._last_join.clear()
+        self._last_join[nickname] = (line, epoch)
+
+    def forget(self, nickname):
+        """Let the user's next join through, e.g. after their last was dropped"""
+        self._last_join.pop(nickname, None)
+
+    def reset_joins(self):
+        """Let every user's next join through"""
+        self._last_join.clear()
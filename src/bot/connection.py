@@ -0,0 +1,148 @@
+"""Keeps the chat connection up and reports how healthy it is.
+
+The supervisor runs the bot's connect coroutine again whenever it fails.
+Retries wait a full-jitter exponential backoff, so the first one comes
+almost at once, a server that keeps failing is not hammered, and many bots
+do not all come back at the same moment. While connected it sends its own
+IRC PINGs, measures the round trip to the PONG and drops a connection that
+stopped answering instead of waiting for TCP to notice.
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+# Seconds a connection has to stay up before the backoff starts over
+STABLE_AFTER = 30
+
+
+class Backoff:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2 ** n))"""
+
+    def __init__(self, base=1, cap=60, rng=None):
+        self.base = base
+        self.cap = cap
+        # Its own generator, so reconnects do not change seeded picks
+        self.rng = rng or random.Random()
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = self.rng.uniform(0, min(self.cap, self.base * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+@dataclass
+class ConnectionStats:
+    """Counters of one bot's chat connection, read by the GUI thread"""
+    connected: bool = False
+    connects: int = 0
+    reconnects: int = 0
+    frames_received: int = 0
+    ping_timeouts: int = 0
+    # Seconds from the last PING to its PONG
+    last_rtt: float = None
+    # Seconds spent disconnected between connections, the current outage
+    # not included
+    downtime: float = 0.0
+    last_outage: float = None
+    # time.monotonic() when the connection was lost, None while connected
+    disconnected_since: float = None
+    last_error: str = None
+
+    def current_outage(self):
+        """Seconds since the connection was lost, 0 while connected"""
+        if self.disconnected_since is None:
+            return 0.0
+        return time.monotonic() - self.disconnected_since
+
+
+class ConnectionSupervisor:
+    """Reconnect loop and keepalive for PickBot.connect"""
+
+    def __init__(self, ping_interval=30, ping_timeout=10, backoff=None):
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.backoff = backoff or Backoff()
+        self.stats = ConnectionStats()
+        self._connected_at = None
+        self._ping = None  # (payload, time.monotonic() it was sent)
+        self._ping_count = 0
+
+    async def run(self, session):
+        """Run session() forever, waiting a backoff delay after each failure"""
+        self.stats.disconnected_since = time.monotonic()
+        while True:
+            try:
+                await session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"\nConnection lost: {str(e)}")
+                self.stats.last_error = str(e)
+            self.disconnected()
+
+            delay = self.backoff.next_delay()
+            print(f"Attempting to reconnect in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            print("Reconnecting...")
+
+    def connected(self):
+        """Call once the connection is up and the channel joined"""
+        now = time.monotonic()
+        stats = self.stats
+        if stats.connects and stats.disconnected_since is not None:
+            stats.last_outage = now - stats.disconnected_since
+            stats.downtime += stats.last_outage
+            stats.reconnects += 1
+        stats.connects += 1
+        stats.connected = True
+        stats.disconnected_since = None
+        self._connected_at = now
+
+    def disconnected(self):
+        now = time.monotonic()
+        if self.stats.connected:
+            self.stats.connected = False
+            self.stats.disconnected_since = now
+        if (self._connected_at is not None
+                and now - self._connected_at >= STABLE_AFTER):
+            self.backoff.reset()
+        self._connected_at = None
+        self._ping = None
+
+    def frame_received(self):
+        self.stats.frames_received += 1
+
+    def pong_received(self, payload):
+        """Measure the round trip if this answers our outstanding PING"""
+        if self._ping is not None and self._ping[0] == payload:
+            self.stats.last_rtt = time.monotonic() - self._ping[1]
+            self._ping = None
+
+    @asynccontextmanager
+    async def keepalive(self, websocket):
+        """PING the server while the block runs and close an unanswered connection"""
+        task = asyncio.create_task(self._keepalive(websocket))
+        try:
+            yield
+        finally:
+            task.cancel()
+
+    async def _keepalive(self, websocket):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self._ping_count += 1
+            payload = f'pugpicker-{self._ping_count}'
+            self._ping = (payload, time.monotonic())
+            await websocket.send(f"PING :{payload}\r\n")
+            await asyncio.sleep(self.ping_timeout)
+            if self._ping is not None and self._ping[0] == payload:
+                print(f"No PONG within {self.ping_timeout} seconds, reconnecting")
+                self.stats.ping_timeouts += 1
+                await websocket.close()
+                return
@@ -1,100 +1,473 @@
 import sqlite3
+import csv
 import datetime
+import threading
+import atexit
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from src.config import *
 
-def initialize_elo_database(self, file):
-    conn = sqlite3.connect(file)
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS player_ratings (
-        nickname TEXT PRIMARY KEY,
-        elo INTEGER DEFAULT 1500,
-        peak_elo INTEGER DEFAULT 1500,
-        games_played INTEGER DEFAULT 0,
-        last_updated INTEGER DEFAULT 0,
-        last_deviation REAL DEFAULT 0
-    )
-    ''')
+# Older SQLite builds cap the number of bound parameters per statement at 999
+SQLITE_MAX_VARIABLES = 900
 
-    conn.commit()
-    conn.close()
+# sqlite3 keeps compiled statements per connection keyed by their SQL text,
+# so long-lived connections plus constant query strings means every helper
+# below reuses its prepared statement instead of recompiling it.
+STATEMENT_CACHE_SIZE = 256
 
+INSERT_RATING = "INSERT OR IGNORE INTO player_ratings (nickname) VALUES (?)"
+SELECT_RATING = "SELECT elo FROM player_ratings WHERE nickname = ?"
 
-def read_elo(self, file, player, change):
-    conn = sqlite3.connect(file)
-    cursor = conn.cursor()
 
-    cursor.execute('''
-    INSERT OR IGNORE INTO player_ratings (nickname) VALUES (?)''',
-                   (player,))
-    cursor.execute('SELECT elo FROM player_ratings WHERE nickname = ?',
-                   (player,))
-    elo = cursor.fetchone()[0]
+def _chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
-    conn.commit()
-    conn.close()
-    return elo
 
+class ConnectionPool:
+    """Long-lived SQLite connections for a single database file.
+
+    All writes share one connection guarded by a lock, so the bot thread and
+    the GUI thread never race each other for the write lock. Every thread
+    gets its own read connection. The file is switched to WAL journaling,
+    which lets those readers run while a write is in progress.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._write_depth = 0
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30,
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor on the writer connection inside one transaction.
+
+        The transaction is committed when the block exits and rolled back if
+        it raises. Nested calls from the same thread join the outer
+        transaction.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            self._write_depth += 1
+            try:
+                yield conn.cursor()
+                if self._write_depth == 1:
+                    conn.commit()
+            except BaseException:
+                if self._write_depth == 1:
+                    conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    @contextmanager
+    def read(self, short_lived=False):
+        """Yield a cursor on this thread's read connection.
+
+        Args:
+            short_lived (bool): Open a connection just for this block and
+                close it afterwards. For threads that only live for a few
+                queries, like the ones Streamlit runs every rerun on.
+        """
+        if short_lived:
+            conn = self._connect()
+            try:
+                yield conn.cursor()
+            finally:
+                conn.close()
+            return
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            self.release_dead_readers()
+            with self._readers_lock:
+                self._readers.append((threading.current_thread(), conn))
+        yield conn.cursor()
+
+    def release_dead_readers(self):
+        """Close the read connections of threads that have exited
+
+        Returns:
+            int: Number of connections closed
+        """
+        with self._readers_lock:
+            dead = [conn for thread, conn in self._readers
+                    if not thread.is_alive()]
+            self._readers = [(thread, conn) for thread, conn in self._readers
+                             if thread.is_alive()]
+        for conn in dead:
+            conn.close()
+        return len(dead)
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for _, conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(file=None):
+    """Return the shared connection pool for a database file (default DB_FILE)."""
+    file = file or DB_FILE
+    with _pools_lock:
+        pool = _pools.get(file)
+        if pool is None:
+            pool = ConnectionPool(file)
+            _pools[file] = pool
+        return pool
+
+
+@atexit.register
+def close_all_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+# Every disk write runs on this one thread. The asyncio chat loop awaits it
+# instead of blocking, and writes from the bot and the GUI are applied in the
+# order they were submitted.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pugpicker-db')
+
+
+def submit_db(func, *args, **kwargs):
+    """Queue func on the database thread and return its Future."""
+    return DB_EXECUTOR.submit(func, *args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """Run func on the database thread and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR,
+                                      functools.partial(func, *args, **kwargs))
+
+
+@atexit.register
+def _shutdown_db_executor():
+    # Registered after close_all_pools, so atexit runs it first
+    DB_EXECUTOR.shutdown(wait=True)
+
+
+def initialize_elo_database(file=None):
+    with get_pool(file).transaction() as cursor:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS player_ratings (
+            nickname TEXT PRIMARY KEY,
+            elo INTEGER DEFAULT 1500,
+            peak_elo INTEGER DEFAULT 1500,
+            games_played INTEGER DEFAULT 0,
+            last_updated INTEGER DEFAULT 0,
+            last_deviation REAL DEFAULT 0
+        )
+        ''')
+
+
+def read_elo(file, player):
+    with get_pool(file).transaction() as cursor:
+        cursor.execute(INSERT_RATING, (player,))
+        cursor.execute(SELECT_RATING, (player,))
+        return cursor.fetchone()[0]
 
-def update_elo( file, player, elo, deviation):
-    conn = sqlite3.connect(file)
-    cursor = conn.cursor()
 
+def update_elo( file, player, elo, deviation):
     timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
-    conn.execute('''UPDATE player_ratings SET elo = ?, last_updated = ?, last_deviation = ? 
-    WHERE 
-    nickname = ?''',
-                 (elo, timestamp, deviation, player))
+    with get_pool(file).transaction() as cursor:
+        cursor.execute('''UPDATE player_ratings SET elo = ?, last_updated = ?, last_deviation = ?
+        WHERE
+        nickname = ?''',
+                       (elo, timestamp, deviation, player))
+
+
+def load_ratings(players, file=None):
+    """Read ratings for many players, unknown players are left out.
+
+    Returns:
+        dict: nickname -> (elo, peak_elo, games_played)
+    """
+    players = list(players)
+    ratings = {}
+    with get_pool(file).read() as cursor:
+        for chunk in _chunked(players, SQLITE_MAX_VARIABLES):
+            cursor.execute('SELECT nickname, elo, peak_elo, games_played '
+                           'FROM player_ratings WHERE nickname IN '
+                           f'({",".join("?" * len(chunk))})', chunk)
+            for nickname, elo, peak_elo, games_played in cursor.fetchall():
+                ratings[nickname] = (elo, peak_elo, games_played)
+    return ratings
+
+
+def store_ratings(rows, replace_all=False, file=None):
+    """Write ratings in one transaction.
+
+    Args:
+        rows (list): (nickname, elo, peak_elo, games_played, last_updated,
+            last_deviation) tuples
+        replace_all (bool): Drop every existing rating first, for full recomputes
+    """
+    with get_pool(file).transaction() as cursor:
+        if replace_all:
+            cursor.execute('DELETE FROM player_ratings')
+        cursor.executemany('INSERT OR REPLACE INTO player_ratings (nickname, '
+                           'elo, peak_elo, games_played, last_updated, '
+                           'last_deviation) VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def load_rating_history(file=None):
+    """Every game_players row needed to replay ratings, oldest game first.
+
+    Returns:
+        list: (game_id, timestamp, nickname, team, result) tuples, grouped by game
+    """
+    with get_pool(file).read() as cursor:
+        cursor.execute('SELECT game_id, timestamp, nickname, team, result '
+                       'FROM game_players ORDER BY timestamp, game_id')
+        return cursor.fetchall()
 
-    conn.commit()
-    conn.close()
 
 def initialize_priority_database():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE IF NOT EXISTS player_priority ("
-                   "nickname TEXT PRIMARY KEY,"
-                   "times_queued INTEGER DEFAULT 0,"
-                   "last_game_time INTEGER DEFAULT 0)")
-    conn.commit()
-    conn.close()
-
-def get_player_priority(name):
-    conn = sqlite3.connect(DB_FILE)
-    try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO player_priority (nickname) VALUES (?)",
-                       (name,))
-        cursor.execute("SELECT times_queued, last_game_time FROM "
-                       "player_priority WHERE nickname = ?", (name,))
-        result = cursor.fetchone()
-
-        conn.commit()
-        return result
-    finally:
-        conn.close()
-
-def increment_all_players(queued_players):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        for player in queued_players:
-            cursor.execute("INSERT OR IGNORE INTO player_priority (nickname) VALUES (?)",
-                           (player,))
-        cursor.execute('UPDATE player_priority SET times_queued = times_queued + 1 WHERE nickname IN ({})'.format(','.join('?' * len(queued_players))), queued_players)
-
-        conn.commit()
-    finally:
-        conn.close()
-
-def reset_priorities(picked_players):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        timestamp = int(datetime.datetime.now().timestamp())
-        cursor.execute('UPDATE player_priority SET times_queued = 0, last_game_time = ? WHERE nickname IN ({})'.format(','.join('?' * len(picked_players))), [timestamp] + list(picked_players))
-        conn.commit()
-
-    finally:
-        conn.close()
\ No newline at end of file
+    with get_pool().transaction() as cursor:
+        cursor.execute("CREATE TABLE IF NOT EXISTS player_priority ("
+                       "nickname TEXT PRIMARY KEY,"
+                       "times_queued INTEGER DEFAULT 0,"
+                       "last_game_time INTEGER DEFAULT 0)")
+
+def load_priorities(names):
+    """Read stored priorities without creating missing rows.
+
+    Returns:
+        dict: nickname -> (times_queued, last_game_time), only for known players
+    """
+    names = list(names)
+    priorities = {}
+    with get_pool().read() as cursor:
+        for chunk in _chunked(names, SQLITE_MAX_VARIABLES):
+            cursor.execute('SELECT nickname, times_queued, last_game_time FROM player_priority WHERE nickname IN ({})'.format(','.join('?' * len(chunk))), chunk)
+            for nickname, times_queued, last_game_time in cursor.fetchall():
+                priorities[nickname] = (times_queued, last_game_time)
+    return priorities
+
+def store_priorities(rows):
+    """Overwrite priorities with absolute values in one transaction.
+
+    Args:
+        rows (list): (nickname, times_queued, last_game_time) tuples
+    """
+    with get_pool().transaction() as cursor:
+        cursor.executemany('INSERT OR REPLACE INTO player_priority '
+                           '(nickname, times_queued, last_game_time) '
+                           'VALUES (?, ?, ?)', rows)
+
+def initialize_history_database():
+    with get_pool().transaction() as cursor:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS games (
+            game_id TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            winner TEXT,
+            team_1_captain TEXT,
+            team_2_captain TEXT,
+            team_1_avg_sr INTEGER,
+            team_2_avg_sr INTEGER
+        )
+        ''')
+        # timestamp is repeated per player so the dashboard filters never
+        # need a join; the primary key doubles as the game_id index
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_players (
+            game_id TEXT NOT NULL,
+            nickname TEXT NOT NULL,
+            role TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            team TEXT NOT NULL,
+            captain INTEGER NOT NULL,
+            result INTEGER NOT NULL,
+            PRIMARY KEY (game_id, nickname)
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_games_timestamp '
+                       'ON games (timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_players_nickname '
+                       'ON game_players (nickname, timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_players_timestamp '
+                       'ON game_players (timestamp, role)')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS player_stats (
+            nickname TEXT PRIMARY KEY,
+            games INTEGER DEFAULT 0,
+            wins INTEGER DEFAULT 0,
+            tank_games INTEGER DEFAULT 0,
+            dps_games INTEGER DEFAULT 0,
+            support_games INTEGER DEFAULT 0,
+            captain_games INTEGER DEFAULT 0,
+            first_played TEXT,
+            last_played TEXT
+        )
+        ''')
+
+def _insert_game_rows(cursor, game_row, player_rows):
+    cursor.execute('INSERT OR REPLACE INTO games (game_id, timestamp, winner, '
+                   'team_1_captain, team_2_captain, team_1_avg_sr, team_2_avg_sr) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?)', game_row)
+    cursor.executemany('INSERT OR REPLACE INTO game_players (game_id, nickname, '
+                       'role, timestamp, team, captain, result) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)', player_rows)
+
+# Adds one game_players row (bound as its columns) onto a player's totals
+UPSERT_PLAYER_STATS = '''
+INSERT INTO player_stats (nickname, games, wins, tank_games, dps_games,
+                          support_games, captain_games, first_played,
+                          last_played)
+VALUES (:nickname, 1, :result, :role = 'tank', :role = 'dps',
+        :role = 'support', :captain, :timestamp, :timestamp)
+ON CONFLICT (nickname) DO UPDATE SET
+    games = games + 1,
+    wins = wins + excluded.wins,
+    tank_games = tank_games + excluded.tank_games,
+    dps_games = dps_games + excluded.dps_games,
+    support_games = support_games + excluded.support_games,
+    captain_games = captain_games + excluded.captain_games,
+    first_played = MIN(first_played, excluded.first_played),
+    last_played = MAX(last_played, excluded.last_played)
+'''
+
+PLAYER_STATS_FROM_HISTORY = '''
+INSERT INTO player_stats (nickname, games, wins, tank_games, dps_games,
+                          support_games, captain_games, first_played,
+                          last_played)
+SELECT nickname, COUNT(*), SUM(result), SUM(role = 'tank'), SUM(role = 'dps'),
+       SUM(role = 'support'), SUM(captain), MIN(timestamp), MAX(timestamp)
+FROM game_players
+'''
+
+def rebuild_player_stats(nicknames=None):
+    """Recompute player_stats from game_players.
+
+    Args:
+        nicknames (list): Only rebuild these players, default everyone
+
+    Returns:
+        int: Number of players in the rebuilt rows
+    """
+    with get_pool().transaction() as cursor:
+        if nicknames is None:
+            cursor.execute('DELETE FROM player_stats')
+            cursor.execute(PLAYER_STATS_FROM_HISTORY + ' GROUP BY nickname')
+            return cursor.rowcount
+
+        nicknames = list(nicknames)
+        for chunk in _chunked(nicknames, SQLITE_MAX_VARIABLES):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'DELETE FROM player_stats WHERE nickname IN ({placeholders})', chunk)
+            cursor.execute(PLAYER_STATS_FROM_HISTORY +
+                           f' WHERE nickname IN ({placeholders}) GROUP BY nickname', chunk)
+        return len(nicknames)
+
+def record_game(game):
+    """Store a finished Game and its players and update player_stats, all in
+    one transaction"""
+    game_id = str(game.game_id)
+    game_row = (game_id, game.timestamp, game.winner,
+                game.team_1_captain, game.team_2_captain,
+                game.team_1_avg_sr, game.team_2_avg_sr)
+    rows = game.player_rows()
+    player_rows = [(game_id, row['nickname'], row['role'],
+                    row['timestamp'], row['team'], int(row['captain']),
+                    row['result'])
+                   for row in rows]
+    with get_pool().transaction() as cursor:
+        cursor.execute('SELECT nickname FROM game_players WHERE game_id = ?',
+                       (game_id,))
+        previous_players = [row[0] for row in cursor.fetchall()]
+        _insert_game_rows(cursor, game_row, player_rows)
+        if previous_players:
+            # Logged again, e.g. a corrected winner: recount instead of adding
+            rebuild_player_stats(set(previous_players) |
+                                 {row['nickname'] for row in rows})
+        else:
+            cursor.executemany(UPSERT_PLAYER_STATS,
+                               [dict(row, captain=int(row['captain']))
+                                for row in rows])
+
+def load_player_stats(nicknames, short_lived=False):
+    """Read aggregate rows for the given players.
+
+    Args:
+        short_lived (bool): See ConnectionPool.read
+
+    Returns:
+        dict: nickname -> dict of player_stats columns
+    """
+    nicknames = list(nicknames)
+    stats = {}
+    with get_pool().read(short_lived) as cursor:
+        for chunk in _chunked(nicknames, SQLITE_MAX_VARIABLES):
+            cursor.execute('SELECT * FROM player_stats WHERE nickname IN ({})'.format(','.join('?' * len(chunk))), chunk)
+            columns = [column[0] for column in cursor.description]
+            for row in cursor.fetchall():
+                stats[row[0]] = dict(zip(columns, row))
+    return stats
+
+def count_games(short_lived=False):
+    with get_pool().read(short_lived) as cursor:
+        cursor.execute('SELECT COUNT(*) FROM games')
+        return cursor.fetchone()[0]
+
+def import_games_csv(path):
+    """Copy a games.csv history into the games tables.
+
+    Returns:
+        int: Number of games imported
+    """
+    games = {}
+    with open(path, newline='') as csvfile:
+        for row in csv.DictReader(csvfile):
+            captain = int(row['captain'] in ('True', 'true', '1'))
+            result = int(row['result'])
+            game = games.setdefault(row['game_id'], {
+                'timestamp': row['timestamp'], 'winner': None,
+                'captains': {}, 'players': []})
+            if result:
+                game['winner'] = row['team']
+            if captain:
+                game['captains'][row['team']] = row['nickname']
+            game['players'].append((row['game_id'], row['nickname'],
+                                    row['role'], row['timestamp'],
+                                    row['team'], captain, result))
+
+    with get_pool().transaction() as cursor:
+        for game_id, game in games.items():
+            game_row = (game_id, game['timestamp'], game['winner'],
+                        game['captains'].get('team1'),
+                        game['captains'].get('team2'), None, None)
+            _insert_game_rows(cursor, game_row, game['players'])
+        rebuild_player_stats()
+    return len(games)
@@ -0,0 +1,165 @@
+import atexit
+import csv
+import datetime
+import os
+import threading
+
+from src.config.settings import *
+from src.bot.database import (count_games, import_games_csv,
+                              initialize_elo_database,
+                              initialize_history_database, record_game)
+from src.bot.ratings import recompute_ratings
+
+HISTORY_FIELDS = ['game_id', 'nickname', 'role', 'timestamp', 'team',
+                  'captain', 'result']
+# Games per Parquet part file while a session runs
+GAMES_PER_PART = 100
+
+
+class CsvGameSink:
+    """Appends games to the flat games.csv history.
+
+    A whole game (all of its player rows) is written with a single open,
+    one buffered write and one fsync.
+    """
+
+    def __init__(self, path=HISTORY_CSV_PATH):
+        self.path = path
+
+    def write_game(self, game):
+        rows = game.player_rows()
+        with open(self.path, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=HISTORY_FIELDS)
+            # tell() is 0 for a new or empty file, saving a separate exists() check
+            if csvfile.tell() == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+
+
+class ParquetGameSink:
+    """Columnar game history, one Parquet file per bot session.
+
+    While the session runs, its games go into numbered part files of up to
+    games_per_part games each. After every game the current part is
+    rewritten (to a temp file that is fsynced and swapped in), so every
+    file on disk is complete and readable by the dashboard, and a game
+    costs at most one part's worth of rows. When the session ends the parts
+    are compacted into session-<id>.parquet; readers ignore the parts of a
+    session that has one, so they never see a game twice. The whole
+    directory can be loaded with HistoryLoader. Needs pyarrow, which is
+    optional.
+    """
+
+    def __init__(self, directory=HISTORY_PARQUET_DIR, session_id=None,
+                 games_per_part=GAMES_PER_PART):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("The parquet game history needs pyarrow, "
+                              "install it with 'pip install pyarrow'") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._schema = pyarrow.schema([
+            ('game_id', pyarrow.string()),
+            ('nickname', pyarrow.string()),
+            ('role', pyarrow.string()),
+            ('timestamp', pyarrow.string()),
+            ('team', pyarrow.string()),
+            ('captain', pyarrow.bool_()),
+            ('result', pyarrow.int8()),
+        ])
+        session_id = session_id or datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.directory = directory
+        self.path = os.path.join(directory, f'session-{session_id}.parquet')
+        self.games_per_part = games_per_part
+        self._parts = []  # paths of the finished and the current part
+        self._rows = []  # rows of the current part
+        self._games = 0  # games in the current part
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _part_path(self, number):
+        return f'{self.path[:-len(".parquet")]}-part{number:04d}.parquet'
+
+    def _write(self, table, path):
+        """Write a table to path atomically and durably"""
+        # Hidden name, so dataset readers skip the file while it is written
+        temp_path = os.path.join(self.directory,
+                                 '.' + os.path.basename(path) + '.tmp')
+        with open(temp_path, 'wb') as f:
+            self._pq.write_table(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def write_game(self, game):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._games == self.games_per_part or not self._parts:
+                self._parts.append(self._part_path(len(self._parts) + 1))
+                self._rows = []
+                self._games = 0
+            self._rows.extend(game.player_rows())
+            self._games += 1
+            self._write(self._pa.Table.from_pylist(self._rows,
+                                                   schema=self._schema),
+                        self._parts[-1])
+
+    def close(self):
+        """End the session: compact its parts into the session file"""
+        with self._lock:
+            if not self._parts:
+                return
+            table = self._pa.concat_tables(
+                [self._pq.read_table(path) for path in self._parts])
+            self._write(table, self.path)
+            # Readers skip the parts from now on
+            for path in self._parts:
+                os.remove(path)
+            self._parts = []
+            self._rows = []
+            self._games = 0
+
+
+class SqliteGameSink:
+    """Stores games in the indexed games/game_players tables of DB_FILE."""
+
+    def __init__(self):
+        initialize_history_database()
+        initialize_elo_database()
+        # First run after upgrading: carry the existing CSV history over
+        if count_games() == 0 and os.path.exists(HISTORY_CSV_PATH):
+            import_games_csv(HISTORY_CSV_PATH)
+            recompute_ratings()
+
+    def write_game(self, game):
+        record_game(game)
+
+
+HISTORY_SINKS = {
+    'csv': CsvGameSink,
+    'parquet': ParquetGameSink,
+    'sqlite': SqliteGameSink,
+}
+
+
+def history_formats(history_format=HISTORY_FORMAT):
+    """Parse the [History] format setting into a list of sink names."""
+    formats = []
+    for name in history_format.split(','):
+        name = name.strip().lower()
+        for expanded in (('csv', 'parquet') if name == 'both' else (name,)):
+            if expanded not in HISTORY_SINKS:
+                raise ValueError(f"Unknown history format '{expanded}', "
+                                 f"expected csv, parquet, sqlite or both")
+            if expanded not in formats:
+                formats.append(expanded)
+    return formats
+
+
+def create_history_sinks(history_format=HISTORY_FORMAT):
+    """Build the sinks selected by the [History] format setting."""
+    return [HISTORY_SINKS[name]() for name in history_formats(history_format)]
@@ -1,8 +1,9 @@
-import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import datetime
 import os
 
+from src.bot.game_history import CsvGameSink
+
 
 @dataclass
 class Game:
@@ -47,31 +48,60 @@ class Game:
                       self.team_2_support1, self.team_2_support2]:
             return 'support'
 
-    def log_game(self, file):
-        game_dic = vars(self)
-
-        for player in game_dic['players']:
-            player_team = 'team1' if player in game_dic['team_1'] else 'team2'
-            player_captain = (player == game_dic['team_1_captain'] or player ==
-                              game_dic['team_2_captain'])
-            result = int(player_team == game_dic['winner'])
+    def player_rows(self):
+        """One history row per player, as written to games.csv"""
+        rows = []
+        for player in self.players:
+            player_team = 'team1' if player in self.team_1 else 'team2'
+            player_captain = (player == self.team_1_captain or player ==
+                              self.team_2_captain)
+            result = int(player_team == self.winner)
 
-            player_dic = {
-                'game_id' : game_dic['game_id'],
+            rows.append({
+                'game_id' : self.game_id,
                 'nickname' : player,
                 'role' : self._return_role(player),
-                'timestamp' : game_dic['timestamp'],
+                'timestamp' : self.timestamp,
                 'team' : player_team,
                 'captain' : player_captain,
                 'result' : result
-            }
+            })
+        return rows
+
+    def log_game(self, sink):
+        """Write the game to a history sink, or to the CSV file at that path"""
+        if isinstance(sink, (str, os.PathLike)):
+            sink = CsvGameSink(sink)
+        sink.write_game(self)
+
+
+# Fields that __post_init__ derives from the others
+_DERIVED_FIELDS = ('players', 'team_1', 'team_2')
+# Fields a Game is constructed from
+_PLAYER_FIELDS = ('team_1_tank', 'team_2_tank', 'team_1_dps1', 'team_1_dps2',
+                  'team_2_dps1', 'team_2_dps2', 'team_1_support1',
+                  'team_1_support2', 'team_2_support1', 'team_2_support2',
+                  'team_1_captain', 'team_2_captain')
+
 
-            file_exists = os.path.exists(file)
+def game_record(game):
+    """JSON serializable copy of a running game, for the queue journal
 
-            with open(file, 'a', newline='') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=player_dic.keys())
-                if not file_exists:
-                    writer.writeheader()
-                writer.writerow(player_dic)
+    Non-standard games are plain dicts already and are copied as they are.
+    """
+    if not isinstance(game, Game):
+        return dict(game)
+    return {field.name: getattr(game, field.name) for field in fields(Game)
+            if field.name not in _DERIVED_FIELDS}
 
 
+def game_from_record(record):
+    """Rebuild the Game (or non-standard game dict) saved by game_record()"""
+    if record.get('nonstandard'):
+        return dict(record)
+    game = Game(**{name: record[name] for name in _PLAYER_FIELDS})
+    # __post_init__ stamps the current time, keep the original one
+    for name in ('timestamp', 'game_id', 'winner', 'team_1_avg_sr',
+                 'team_2_avg_sr'):
+        setattr(game, name, record.get(name))
+    return game
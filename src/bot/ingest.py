@@ -0,0 +1,153 @@
+"""Bounded buffer between reading chat and handling it.
+
+The reader task puts every chat message that needs handling (admin commands
+and role keywords) in here and goes straight back to the socket, the
+handler workers take them out in arrival order. When the buffer is full:
+
+1. A join that repeats a join of the same viewer still waiting in the
+   buffer is dropped, it would not change anything.
+2. Otherwise the oldest such duplicate join in the buffer makes room.
+3. Otherwise the overflow policy decides: 'drop_newest' drops the incoming
+   message, 'drop_oldest' evicts the oldest waiting one.
+
+Admin commands are never dropped and never evicted, they go in even if that
+takes the buffer over its size.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest')
+
+_PENDING, _TAKEN, _DROPPED = range(3)
+
+
+class ChatMessage:
+    __slots__ = ('username', 'content', 'admin', 'duplicate', 'state')
+
+    def __init__(self, username, content, admin, duplicate):
+        self.username = username
+        self.content = content
+        self.admin = admin
+        self.duplicate = duplicate
+        self.state = _PENDING
+
+
+@dataclass
+class IngestStats:
+    """Counters of the ingest buffer, read by the GUI thread"""
+    depth: int = 0
+    peak_depth: int = 0
+    enqueued: int = 0
+    handled: int = 0
+    # Chat lines that are not commands or role keywords, never buffered
+    ignored: int = 0
+    dropped_duplicates: int = 0
+    dropped_overflow: int = 0
+
+
+class IngestBuffer:
+    """Bounded FIFO of chat messages with the overflow policy above.
+
+    Only used on the bot's event loop thread. Every operation is O(1),
+    dropped messages are marked and skipped when their turn comes.
+    """
+
+    def __init__(self, maxsize=10000, overflow='drop_oldest', on_drop=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, "
+                             f"expected one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        # Called with every buffered message that is evicted
+        self.on_drop = on_drop
+        self.stats = IngestStats()
+        self._messages = deque()
+        # Subsets of _messages in the same order, may hold stale entries
+        self._droppable = deque()
+        self._duplicates = deque()
+        # (username, content) -> number of those joins waiting
+        self._pending_joins = {}
+        self._ready = None
+
+    def __len__(self):
+        return self.stats.depth
+
+    def put(self, username, content, admin=False):
+        """Buffer a message, returns False if it was dropped"""
+        stats = self.stats
+        key = (username, content)
+        duplicate = not admin and key in self._pending_joins
+        if stats.depth >= self.maxsize and not admin:
+            if duplicate:
+                stats.dropped_duplicates += 1
+                return False
+            if not self._evict(self._duplicates):
+                if self.overflow == 'drop_newest':
+                    stats.dropped_overflow += 1
+                    return False
+                self._evict(self._droppable)
+
+        message = ChatMessage(username, content, admin, duplicate)
+        self._messages.append(message)
+        if not admin:
+            self._pending_joins[key] = self._pending_joins.get(key, 0) + 1
+            self._droppable.append(message)
+            if duplicate:
+                self._duplicates.append(message)
+        stats.enqueued += 1
+        stats.depth += 1
+        if stats.depth > stats.peak_depth:
+            stats.peak_depth = stats.depth
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def _evict(self, candidates):
+        """Drop the oldest still waiting message of candidates"""
+        while candidates:
+            message = candidates.popleft()
+            if message.state == _PENDING:
+                self._release(message, _DROPPED)
+                if message.duplicate:
+                    self.stats.dropped_duplicates += 1
+                else:
+                    self.stats.dropped_overflow += 1
+                if self.on_drop is not None:
+                    self.on_drop(message)
+                return True
+        return False
+
+    def _release(self, message, state):
+        message.state = state
+        self.stats.depth -= 1
+        if not message.admin:
+            key = (message.username, message.content)
+            count = self._pending_joins[key] - 1
+            if count:
+                self._pending_joins[key] = count
+            else:
+                del self._pending_joins[key]
+
+    def pop(self):
+        """Oldest waiting message, or None if there is none"""
+        messages = self._messages
+        while messages:
+            message = messages.popleft()
+            if message.state == _PENDING:
+                self._release(message, _TAKEN)
+                self.stats.handled += 1
+                # Everything older is gone, so are their stale references
+                for candidates in (self._droppable, self._duplicates):
+                    while candidates and candidates[0].state != _PENDING:
+                        candidates.popleft()
+                return message
+        return None
+
+    async def wait(self):
+        """Wait until there is a message to pop"""
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        while not self.stats.depth:
+            self._ready.clear()
+            await self._ready.wait()
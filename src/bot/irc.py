@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+
+# IRCv3 tag values escape these characters, see https://ircv3.net/specs/extensions/message-tags
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+@dataclass
+class IrcMessage:
+    command: str
+    params: list[str] = field(default_factory=list)
+    prefix: str = None
+    tags: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def nick(self):
+        """Nickname part of the prefix (nick!user@host), or None for server messages"""
+        if not self.prefix or '!' not in self.prefix:
+            return None
+        return self.prefix.split('!', 1)[0]
+
+    @property
+    def trailing(self):
+        return self.params[-1] if self.params else ''
+
+
+def _unescape_tag(value):
+    if '\\' not in value:
+        return value
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            escaped = next(chars, '')
+            result.append(_TAG_ESCAPES.get(escaped, escaped))
+        else:
+            result.append(char)
+    return ''.join(result)
+
+
+def parse_line(line):
+    """Parse a single IRC line into an IrcMessage, or None if it is empty."""
+    if not line:
+        return None
+
+    tags = {}
+    if line[0] == '@':
+        raw_tags, _, line = line[1:].partition(' ')
+        for tag in raw_tags.split(';'):
+            key, _, value = tag.partition('=')
+            tags[key] = _unescape_tag(value)
+
+    prefix = None
+    if line[:1] == ':':
+        prefix, _, line = line[1:].partition(' ')
+
+    line, has_trailing, trailing = line.partition(' :')
+    params = line.split()
+    if not params:
+        return None
+    command = params.pop(0).upper()
+    if has_trailing:
+        params.append(trailing)
+
+    return IrcMessage(command=command, params=params, prefix=prefix, tags=tags)
+
@@ -0,0 +1,239 @@
+"""Crash-safe journal of the queue and the running games.
+
+Every queue change event is appended as one JSON line to the journal file by
+a background thread that follows Queue.changes, so the event loop never
+waits for the disk. Every snapshot_every events the whole state is written
+to the snapshot file (to a temporary file that atomically replaces the old
+one) and the journal is started over. After a crash or restart the state
+is the snapshot plus the events journaled after it, which is at most
+snapshot_every lines to replay however long the queue was.
+
+The state is a plain dict:
+    version: Queue version of the last applied event
+    is_active: Queue state
+    players: Username -> role bitmask, in the order they joined
+    games: game_id -> game_log.game_record() of every running game
+
+Lines are flushed to the operating system after every batch of events, so
+they survive the process crashing. A torn last line is cut off on recovery.
+One bot at a time owns a journal: recover() and start() take an exclusive
+lock on a .lock file next to it, which stop() releases.
+"""
+import atexit
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from src.bot.queue import ROLE_BITS
+
+# Journal lines between two snapshots
+SNAPSHOT_EVERY = 1000
+
+
+def empty_state():
+    return {'version': 0, 'is_active': 'inactive', 'players': {}, 'games': {}}
+
+
+def _role_mask(roles):
+    mask = 0
+    for role in roles:
+        mask |= ROLE_BITS[role]
+    return mask
+
+
+def _lock_file(file):
+    """Lock an open file exclusively without waiting, OSError if it is taken"""
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def apply_event(state, version, kind, data):
+    """Apply one queue change event to a journal state, in place"""
+    players = state['players']
+    if kind == 'join':
+        username = data['username']
+        players[username] = players.get(username, 0) | _role_mask(data['roles'])
+    elif kind == 'add':
+        bit = ROLE_BITS[data['role']]
+        for username in data['usernames']:
+            players[username] = players.get(username, 0) | bit
+    elif kind == 'clear':
+        players.clear()
+    elif kind == 'state':
+        state['is_active'] = str(data['state'])
+    elif kind == 'pick':
+        for game_id, record in zip(data['games'], data.get('records', ())):
+            state['games'][game_id] = record
+    elif kind == 'winner':
+        state['games'].pop(data['game_id'], None)
+    state['version'] = version
+
+
+class QueueJournal:
+    """Append-only journal plus periodic snapshots of one bot's queue"""
+
+    def __init__(self, path, snapshot_path=None,
+                 snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.snapshot_path = (snapshot_path or
+                              os.path.splitext(path)[0] + '.snapshot.json')
+        self.snapshot_every = snapshot_every
+        self._state = empty_state()
+        self._lines = 0
+        # Set by recover(), None keeps the journal as it is
+        self._valid_size = None
+        self._file = None
+        self._queue = None
+        self._resync = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = None
+
+    def _acquire(self):
+        """Take the journal's lock file, or fail if another bot holds it"""
+        if self._lock is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock = open(self.path + '.lock', 'a')
+        try:
+            _lock_file(lock)
+        except OSError:
+            lock.close()
+            raise RuntimeError(f"The queue journal {self.path} is used by "
+                               f"another running bot") from None
+        self._lock = lock
+
+    def recover(self):
+        """Load the latest snapshot and replay the journal written after it
+
+        Returns:
+            dict: The recovered state, empty_state() if nothing was saved
+        """
+        self._acquire()
+        state = empty_state()
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            pass
+
+        lines = 0
+        # Bytes up to the end of the last complete line
+        self._valid_size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # The process died in the middle of this line
+                        break
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+                    lines += 1
+                    self._valid_size += len(line)
+                    # Written again after a snapshot that already has them
+                    if event['version'] > state['version']:
+                        apply_event(state, event['version'], event['kind'],
+                                    event['data'])
+        except FileNotFoundError:
+            pass
+
+        self._state = state
+        self._lines = lines
+        return state
+
+    def start(self, queue, resync):
+        """Journal the changes of queue on a background thread until stop()
+
+        Args:
+            queue (Queue): Queue whose version continues from the recovered
+                state
+            resync (callable): Returns the current state as a dict, used if
+                the journal fell so far behind that the changes feed no
+                longer has the events it missed
+        """
+        if self._thread is not None:
+            return
+        self._acquire()
+        self._queue = queue
+        self._resync = resync
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self._valid_size is not None:
+            # New lines must not be glued to a torn one
+            self._file.truncate(self._valid_size)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._write_loop,
+                                        name='pugpicker-queue-journal',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Write the events that are still pending and close the journal"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+        if self._lock is not None:
+            # Closing the file releases the lock
+            self._lock.close()
+            self._lock = None
+
+    def _write_loop(self):
+        changes = self._queue.changes
+        while not self._stop.is_set():
+            self._write(changes.wait(self._state['version'], timeout=0.5))
+        # Whatever was published before stop()
+        self._write(changes.since(self._state['version']))
+
+    def _write(self, events):
+        try:
+            if events is None:
+                self._state = self._resync()
+                self._write_snapshot()
+            elif events:
+                self._append(events)
+        except Exception as e:
+            print(f"Failed to write the queue journal: {e}")
+
+    def _append(self, events):
+        lines = []
+        for event in events:
+            # The feed can repeat events a resync already covered
+            if event.version <= self._state['version']:
+                continue
+            apply_event(self._state, event.version, event.kind, event.data)
+            lines.append(json.dumps({'version': event.version,
+                                     'kind': event.kind, 'data': event.data}))
+        if not lines:
+            return
+        self._file.write('\n'.join(lines) + '\n')
+        self._file.flush()
+        self._lines += len(lines)
+        if self._lines >= self.snapshot_every:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        """Save the whole state, then start the journal over"""
+        temporary = self.snapshot_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        # A crash before the truncation only leaves lines the snapshot has
+        self._file.close()
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._lines = 0
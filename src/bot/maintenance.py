@@ -0,0 +1,59 @@
+"""Maintenance commands for the bot database.
+
+    python -m src.bot.maintenance rebuild-stats
+    python -m src.bot.maintenance import-csv archive/games.csv
+    python -m src.bot.maintenance recompute-ratings
+"""
+import argparse
+import time
+
+from src.bot.database import (import_games_csv, initialize_elo_database,
+                              initialize_history_database,
+                              rebuild_player_stats)
+from src.bot.ratings import recompute_ratings
+
+
+def rebuild_stats(args):
+    players = rebuild_player_stats()
+    print(f"Rebuilt statistics for {players} players")
+
+
+def import_csv(args):
+    games = import_games_csv(args.path)
+    print(f"Imported {games} games from {args.path}")
+
+
+def recompute(args):
+    started = time.perf_counter()
+    players = recompute_ratings()
+    print(f"Recomputed ratings for {players} players in "
+          f"{time.perf_counter() - started:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser(
+        'rebuild-stats',
+        help='regenerate the player_stats table from the game history'
+    ).set_defaults(func=rebuild_stats)
+
+    import_parser = commands.add_parser(
+        'import-csv', help='copy a games.csv history into the database')
+    import_parser.add_argument('path')
+    import_parser.set_defaults(func=import_csv)
+
+    commands.add_parser(
+        'recompute-ratings',
+        help='replay the game history to rebuild every Elo rating'
+    ).set_defaults(func=recompute)
+
+    args = parser.parse_args(argv)
+    initialize_history_database()
+    initialize_elo_database()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import atexit
+import datetime
+import threading
+from collections import OrderedDict
+
+from src.bot.database import load_priorities, store_priorities, submit_db
+
+
+class PriorityCache:
+    """In-memory, write-behind copy of the player_priority table.
+
+    The bot process is the only writer of priorities, so picks read and
+    update them here. Rows are loaded the first time a nickname is seen,
+    all misses of one call in a single query; on the event loop, await
+    load() on the database thread first so nothing is read there. Changes
+    are written back in one batch: every flush_interval seconds, at
+    shutdown, or whenever flush() is called (the bot does after every pick,
+    so other processes see the table as the pick left it). The least
+    recently used viewers are evicted once max_size is exceeded, never the
+    ones the current call is about, so the cache can hold more than
+    max_size while more viewers than that are queued. Unflushed changes of
+    evicted viewers are kept until the next flush.
+    """
+
+    def __init__(self, max_size=50000, flush_interval=30):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()  # nickname -> [times_queued, last_game_time]
+        self._dirty = set()
+        self._evicted = {}  # dirty rows pushed out by the LRU, not yet written
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def missing(self, names):
+        """Nicknames that would need a database read"""
+        with self._lock:
+            return [name for name in names
+                    if name not in self._entries and name not in self._evicted]
+
+    def load(self, names):
+        """Read uncached nicknames from SQLite. Safe to run on the DB thread."""
+        names = set(names)
+        missing = self.missing(names)
+        if not missing:
+            return
+        rows = load_priorities(missing)
+        with self._lock:
+            self._add_rows(missing, rows)
+            self._evict(names)
+
+    def _add_rows(self, names, rows):
+        for name in names:
+            # Cached, or evicted with changes newer than the row, meanwhile
+            if name in self._entries or name in self._evicted:
+                continue
+            row = rows.get(name)
+            if row is None:
+                self._dirty.add(name)
+                row = (0, 0)
+            self._entries[name] = list(row)
+
+    def _entries_of(self, names):
+        """Cached entries of names, reading every miss in one query"""
+        entries = self._entries
+        missing = [name for name in names
+                   if name not in entries and name not in self._evicted]
+        if missing:
+            self._add_rows(missing, load_priorities(missing))
+        result = []
+        for name in names:
+            entry = entries.get(name)
+            if entry is None:
+                entry = self._evicted.pop(name)
+                self._dirty.add(name)
+                entries[name] = entry
+            else:
+                entries.move_to_end(name)
+            result.append(entry)
+        return result
+
+    def _evict(self, keep=()):
+        """Shrink to max_size, least recently used first, sparing keep"""
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return
+        victims = []
+        for name in self._entries:
+            if name not in keep:
+                victims.append(name)
+                if len(victims) == excess:
+                    break
+        for name in victims:
+            entry = self._entries.pop(name)
+            if name in self._dirty:
+                self._dirty.discard(name)
+                self._evicted[name] = entry
+
+    def get_many(self, names):
+        """Return nickname -> (times_queued, last_game_time)"""
+        names = set(names)
+        with self._lock:
+            priorities = {name: tuple(entry) for name, entry
+                          in zip(names, self._entries_of(names))}
+            self._evict(names)
+            return priorities
+
+    def increment(self, names):
+        names = set(names)
+        with self._lock:
+            for entry in self._entries_of(names):
+                entry[0] += 1
+            self._dirty.update(names)
+            self._evict(names)
+
+    def increment_and_get(self, names):
+        """Bump times_queued of names and return their priorities"""
+        names = set(names)
+        with self._lock:
+            self.increment(names)
+            return self.get_many(names)
+
+    def reset(self, names, timestamp=None):
+        if timestamp is None:
+            timestamp = int(datetime.datetime.now().timestamp())
+        names = set(names)
+        with self._lock:
+            for entry in self._entries_of(names):
+                entry[0] = 0
+                entry[1] = timestamp
+            self._dirty.update(names)
+            self._evict(names)
+
+    def flush(self):
+        """Write every pending change to SQLite in one transaction.
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._lock:
+            rows = dict(self._evicted)
+            for name in self._dirty:
+                rows[name] = self._entries[name]
+            rows = [(name, entry[0], entry[1]) for name, entry in rows.items()]
+            evicted = self._evicted
+            dirty = self._dirty
+            self._evicted = {}
+            self._dirty = set()
+
+        if not rows:
+            return 0
+        try:
+            store_priorities(rows)
+        except Exception:
+            # Put the rows back so the next flush retries them
+            with self._lock:
+                for name, entry in evicted.items():
+                    if name not in self._entries:
+                        self._evicted.setdefault(name, entry)
+                self._dirty.update(name for name in dirty
+                                   if name in self._entries)
+            raise
+        return len(rows)
+
+    def start(self):
+        """Flush on the DB thread every flush_interval seconds until stop()"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop,
+                                        name='pugpicker-priority-flush',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush timer and write out anything still pending"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                submit_db(self.flush).result()
+            except Exception as e:
+                print(f"Failed to flush player priorities: {e}")
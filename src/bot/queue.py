@@ -1,16 +1,392 @@
+"""The role queues of one bot, indexed by role bitmask.
+
+Players are changed through Queue.join, Queue.add and Queue.clear only.
+Queue.tank, Queue.dps and Queue.support are read-only views: they support
+membership, len, iteration and set operators, but not add, discard, clear
+or update like the plain sets they replaced.
+"""
+import threading
+from collections.abc import Set
 from dataclasses import dataclass
+from enum import Enum
+
+from src.bot.change_feed import ChangeEvent, ChangeFeed
+
+TANK = 1
+DPS = 2
+SUPPORT = 4
+ALL_ROLES = TANK | DPS | SUPPORT
+
+ROLE_NAMES = (('tank', TANK), ('dps', DPS), ('support', SUPPORT))
+ROLE_BITS = dict(ROLE_NAMES)
+
+# Chat keyword -> bitmask of the roles it joins
+ROLE_KEYWORDS = {
+    'tank': TANK,
+    'dps': DPS,
+    'support': SUPPORT,
+    'tankdps': TANK | DPS,
+    'tanksupport': TANK | SUPPORT,
+    'dpssupport': DPS | SUPPORT,
+    'flex': ALL_ROLES,
+}
+
+
+# Changes after which repeating a join can have an effect again
+EPOCH_EVENTS = frozenset(('clear', 'state'))
+
+
+class QueueState(str, Enum):
+    """State of the queue. Members compare equal to their plain string value."""
+    INACTIVE = 'inactive'
+    ACTIVE = 'active'
+    INGAME = 'ingame'
+
+    def __str__(self):
+        return self.value
+
+
+def count_players(mask_counts, roles=ALL_ROLES):
+    """Players that can fill at least one of the roles in the bitmask.
+
+    Args:
+        mask_counts (tuple): Number of players queued for exactly each
+            combination of roles, indexed by bitmask
+    """
+    return sum(count for mask, count in enumerate(mask_counts) if mask & roles)
+
+
+def _slots(needed, roles):
+    """Slots of the roles in the bitmask, needed maps role name -> slots"""
+    return sum(needed.get(name, 0) for name, bit in ROLE_NAMES if roles & bit)
+
+
+def fill_shortfall(mask_counts, needed):
+    """Check whether the queued players can fill every role slot.
+
+    By Hall's theorem every slot can be filled, with each player taking at
+    most one, exactly when every set of roles has at least as many players
+    queued for one of them as it has slots. With three roles there are only
+    seven sets to check, so the answer is exact and takes constant time
+    however long the queue is.
+
+    Args:
+        mask_counts (tuple): Number of players queued for exactly each
+            combination of roles, indexed by bitmask
+        needed (dict): Role name -> number of slots to fill
+
+    Returns:
+        tuple: (roles, missing), the bitmask of the role set that is short
+            the most players and how many it is short, (0, 0) if every slot
+            can be filled
+    """
+    worst_roles, worst_missing = 0, 0
+    for roles in range(1, ALL_ROLES + 1):
+        missing = _slots(needed, roles) - count_players(mask_counts, roles)
+        if missing > worst_missing:
+            worst_roles, worst_missing = roles, missing
+    return worst_roles, worst_missing
+
+
+def lobbies_available(mask_counts, per_lobby):
+    """How many lobbies of the composition the queued players can fill at once
+
+    Hall's condition scales with the number of lobbies, so each role set
+    allows as many lobbies as its players cover its slots that many times.
+
+    Args:
+        per_lobby (dict): Role name -> slots in one lobby (both teams)
+    """
+    lobbies = None
+    for roles in range(1, ALL_ROLES + 1):
+        slots = _slots(per_lobby, roles)
+        if slots:
+            fits = count_players(mask_counts, roles) // slots
+            lobbies = fits if lobbies is None else min(lobbies, fits)
+    return lobbies or 0
+
+
+def role_names(roles):
+    """Names of the roles in a bitmask, in tank, dps, support order"""
+    return [name for name, bit in ROLE_NAMES if roles & bit]
+
+
+@dataclass(frozen=True)
+class QueueSnapshot:
+    """Immutable copy of the queue at one version, safe to read from any thread"""
+    version: int = 0
+    is_active: QueueState = QueueState.INACTIVE
+    tank: frozenset = frozenset()
+    dps: frozenset = frozenset()
+    support: frozenset = frozenset()
+    # Players queued for exactly each role combination, indexed by bitmask
+    mask_counts: tuple = (0,) * (ALL_ROLES + 1)
+    # Ids of the games waiting for a winner, oldest first
+    games: tuple = ()
+
+    @property
+    def tank_count(self):
+        return len(self.tank)
+
+    @property
+    def dps_count(self):
+        return len(self.dps)
+
+    @property
+    def support_count(self):
+        return len(self.support)
+
+    @property
+    def players(self):
+        """Everyone queued for at least one role"""
+        return self.tank | self.dps | self.support
+
+    def count_players(self, roles=ALL_ROLES):
+        return count_players(self.mask_counts, roles)
+
+    def fill_shortfall(self, needed):
+        return fill_shortfall(self.mask_counts, needed)
+
+    def can_fill(self, needed):
+        return fill_shortfall(self.mask_counts, needed)[1] == 0
+
+    def lobbies_available(self, per_lobby):
+        return lobbies_available(self.mask_counts, per_lobby)
 
 
+class RoleView(Set):
+    """Read-only set of the names queued for one role.
+
+    Backed by the queue's player ids, so it is always up to date. Set
+    operators like | and & return plain sets.
+    """
+
+    def __init__(self, queue, bit):
+        self._queue = queue
+        self._bit = bit
+
+    def __contains__(self, username):
+        player_id = self._queue._ids.get(username)
+        return (player_id is not None
+                and bool(self._queue._masks[player_id] & self._bit))
+
+    def __iter__(self):
+        return map(self._queue._names.__getitem__,
+                   self._queue._members[self._bit])
+
+    def __len__(self):
+        return len(self._queue._members[self._bit])
+
+    def __repr__(self):
+        return f'RoleView({set(self)!r})'
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return set(iterable)
+
 
-@dataclass
 class Queue:
-    is_active: str = 'inactive'
-    tank: set[str] = None
-    dps: set[str] = None
-    support: set[str] = None
-
-    def __post_init__(self):
-        self.tank = set() if self.tank is None else self.tank
-        self.dps = set() if self.dps is None else self.dps
-        self.support = set() if self.support is None else self.support
-        return
+    """The role queues, changed only on the bot's event loop thread.
+
+    Each player name is interned to an integer id once. The queue keeps a
+    role bitmask per id, the ids queued for each role, and how many players
+    are queued for each of the 8 role combinations, all updated in place.
+    Joining and every count are O(1), and tank, dps and support are
+    read-only RoleView sets of names on top of it.
+
+    Every change bumps version and is described by a ChangeEvent: 'join'
+    (username, roles), 'add' (role, usernames), 'clear', 'state' (state),
+    'pick' (games, players, records) or 'winner' (game_id, winner).
+    publish() copies the current state into an immutable QueueSnapshot,
+    which other threads (the GUI) read through snapshot without locking,
+    and hands the new events to the changes feed. The bot
+    publishes once per websocket frame and once per GUI command, so a burst
+    of joins costs a single copy and a single wakeup.
+
+    epoch only moves on changes that can make a repeated join do something
+    again (a clear or a state change), so a join seen in the same
+    epoch as the same player's last one can be skipped.
+    """
+
+    def __init__(self, is_active=QueueState.INACTIVE, tank=None, dps=None,
+                 support=None):
+        self._lock = threading.Lock()
+        self._state = QueueState(is_active)
+        self._reset()
+        self.tank = RoleView(self, TANK)
+        self.dps = RoleView(self, DPS)
+        self.support = RoleView(self, SUPPORT)
+        for role, usernames in (('tank', tank), ('dps', dps),
+                                ('support', support)):
+            for username in usernames or ():
+                self._change_roles(self._intern(username), ROLE_BITS[role], 0)
+
+        self._games = []
+        self.version = 0
+        self.epoch = 0
+        self._pending = []
+        self.changes = ChangeFeed()
+        self.snapshot = self._take_snapshot()
+
+    def _reset(self):
+        self._ids = {}
+        self._names = []
+        self._masks = []
+        self._members = {bit: set() for _, bit in ROLE_NAMES}
+        self._mask_counts = [0] * (ALL_ROLES + 1)
+
+    def _intern(self, username):
+        player_id = self._ids.get(username)
+        if player_id is None:
+            player_id = len(self._names)
+            self._ids[username] = player_id
+            self._names.append(username)
+            self._masks.append(0)
+        return player_id
+
+    def _change_roles(self, player_id, add, remove):
+        """Set and clear role bits of a player, returns the bits that changed"""
+        old = self._masks[player_id]
+        new = (old | add) & ~remove
+        changed = old ^ new
+        if changed:
+            self._masks[player_id] = new
+            # Index 0 (not queued at all) is left at 0
+            if old:
+                self._mask_counts[old] -= 1
+            if new:
+                self._mask_counts[new] += 1
+            for _, bit in ROLE_NAMES:
+                if changed & bit:
+                    if new & bit:
+                        self._members[bit].add(player_id)
+                    else:
+                        self._members[bit].discard(player_id)
+        return changed
+
+    @property
+    def is_active(self):
+        return self._state
+
+    @is_active.setter
+    def is_active(self, state):
+        state = QueueState(state)
+        with self._lock:
+            if state != self._state:
+                self._state = state
+                self._record('state', state=state)
+
+    def join(self, username, roles):
+        """Add a player to every role in the roles bitmask.
+
+        Returns:
+            list: Names of the roles the player was not already queued for
+        """
+        with self._lock:
+            added = self._change_roles(self._intern(username),
+                                       roles & ALL_ROLES, 0)
+            if not added:
+                return []
+            joined = role_names(added)
+            self._record('join', username=username, roles=joined)
+        return joined
+
+    def add(self, role, usernames):
+        """Queue several players for one role"""
+        usernames = list(usernames)
+        bit = ROLE_BITS[role]
+        with self._lock:
+            for username in usernames:
+                self._change_roles(self._intern(username), bit, 0)
+            self._record('add', role=role, usernames=usernames)
+
+    def clear(self):
+        """Remove everyone from every role"""
+        with self._lock:
+            self._reset()
+            self._record('clear')
+
+    def count_players(self, roles=ALL_ROLES):
+        """Players queued for at least one of the roles in the bitmask, O(1)"""
+        return count_players(self._mask_counts, roles)
+
+    def fill_shortfall(self, needed):
+        """Role set short the most players for the slots, see fill_shortfall()"""
+        return fill_shortfall(self._mask_counts, needed)
+
+    def can_fill(self, needed):
+        """Whether every slot of needed (role name -> slots) can be filled, O(1)"""
+        return fill_shortfall(self._mask_counts, needed)[1] == 0
+
+    def lobbies_available(self, per_lobby):
+        """Lobbies of the composition that can be filled at once, O(1)"""
+        return lobbies_available(self._mask_counts, per_lobby)
+
+    def record_pick(self, game_ids, players, records=()):
+        """Announce that teams were picked from the queue
+
+        Args:
+            game_ids (list): Ids of the new games
+            players (list): Everyone picked
+            records (list): game_log.game_record() of each game, so the
+                journal can restore games that were still running
+        """
+        with self._lock:
+            self._games.extend(game_ids)
+            self._record('pick', games=list(game_ids), players=list(players),
+                         records=list(records))
+
+    def record_winner(self, game_id, winner):
+        """Announce that a running game is over"""
+        with self._lock:
+            if game_id in self._games:
+                self._games.remove(game_id)
+            self._record('winner', game_id=game_id, winner=winner)
+
+    def player_masks(self):
+        """Role bitmask of every queued player, in the order they joined"""
+        return {self._names[player_id]: mask
+                for player_id, mask in enumerate(self._masks) if mask}
+
+    def restore(self, version, is_active, player_masks, games=()):
+        """Replace the whole state, e.g. with one recovered from the journal
+
+        The version carries on from the recovered one, so the versions of
+        new events follow the journaled ones. Only call this before anyone
+        follows the changes feed.
+        """
+        with self._lock:
+            self._reset()
+            for username, mask in player_masks.items():
+                self._change_roles(self._intern(username), mask & ALL_ROLES, 0)
+            self._state = QueueState(is_active)
+            self._games = list(games)
+            self.version = version
+            self.epoch += 1
+            self._pending = []
+            self.changes.version = version
+            self.snapshot = self._take_snapshot()
+
+    def _record(self, kind, **data):
+        self.version += 1
+        if kind in EPOCH_EVENTS:
+            self.epoch += 1
+        self._pending.append(ChangeEvent(self.version, kind, data))
+
+    def _take_snapshot(self):
+        return QueueSnapshot(self.version, self._state, frozenset(self.tank),
+                             frozenset(self.dps), frozenset(self.support),
+                             tuple(self._mask_counts), tuple(self._games))
+
+    def publish(self):
+        """Make the current state visible to other threads, if it changed
+
+        Returns:
+            QueueSnapshot: The latest snapshot
+        """
+        with self._lock:
+            if self.snapshot.version != self.version:
+                self.snapshot = self._take_snapshot()
+                events, self._pending = self._pending, []
+                self.changes.extend(events)
+            return self.snapshot
@@ -0,0 +1,146 @@
+"""Team Elo ratings.
+
+Both teams are rated by the average Elo of their players. After a game every
+player of the winning team gains the same amount and every player of the
+losing team loses it, so the ratings of a game always add up to zero.
+"""
+import numpy as np
+
+from src.bot.database import (load_rating_history, load_ratings,
+                              store_ratings)
+
+DEFAULT_RATING = 1500
+K_FACTOR = 32
+
+
+def expected_score(team_rating, opponent_rating):
+    """Chance that a team beats its opponent, from their average ratings"""
+    return 1 / (1 + 10 ** ((opponent_rating - team_rating) / 400))
+
+
+def rating_change(team_1_rating, team_2_rating, team_1_won):
+    """Elo gained by each team 1 player, team 2 players lose the same"""
+    return K_FACTOR * (float(team_1_won) -
+                       expected_score(team_1_rating, team_2_rating))
+
+
+def team_averages(game, ratings):
+    """Average rating of both teams of a Game, unrated players count as new"""
+    def average(team):
+        return sum(ratings.get(player, (DEFAULT_RATING,))[0]
+                   for player in team) / len(team)
+    return average(game.team_1), average(game.team_2)
+
+
+def rate_game(game):
+    """Apply one finished game to the stored ratings.
+
+    Only the ten players of the game are read and written. Unless team
+    balancing already set them, the pre-game team averages are stored on the
+    game as team_1_avg_sr and team_2_avg_sr.
+    """
+    ratings = load_ratings(game.players)
+    team_1_rating, team_2_rating = team_averages(game, ratings)
+    if game.team_1_avg_sr is None:
+        game.team_1_avg_sr = round(team_1_rating)
+        game.team_2_avg_sr = round(team_2_rating)
+    if game.winner not in ('team1', 'team2'):
+        return
+
+    change = rating_change(team_1_rating, team_2_rating,
+                           game.winner == 'team1')
+    rows = []
+    for player in game.players:
+        elo, peak_elo, games_played = ratings.get(
+            player, (DEFAULT_RATING, DEFAULT_RATING, 0))
+        deviation = change if player in game.team_1 else -change
+        elo += deviation
+        rows.append((player, elo, max(peak_elo, elo), games_played + 1,
+                     game.timestamp, deviation))
+    store_ratings(rows)
+
+
+def replay_ratings(rows):
+    """Compute every rating from scratch by replaying the game history.
+
+    Players are mapped to integer IDs so all state lives in NumPy arrays,
+    each game only touches its own players with fancy indexing. Games
+    without a winner are left out, as rate_game leaves them out.
+
+    Args:
+        rows (list): (game_id, timestamp, nickname, team, result) tuples in
+            chronological order, with the rows of a game next to each other
+
+    Returns:
+        list: (nickname, elo, peak_elo, games_played, last_updated,
+            last_deviation) tuples for store_ratings
+    """
+    # No player of a game without a winner has a result of 1
+    decided = {row[0] for row in rows if row[4]}
+    rows = [row for row in rows if row[0] in decided]
+    if not rows:
+        return []
+    ids = {}
+    player_ids = np.fromiter((ids.setdefault(row[2], len(ids)) for row in rows),
+                             dtype=np.int64, count=len(rows))
+    nicknames = list(ids)
+    on_team_1 = np.fromiter((row[3] == 'team1' for row in rows),
+                            dtype=bool, count=len(rows))
+    results = np.fromiter((row[4] for row in rows), dtype=np.int8,
+                          count=len(rows))
+
+    # A new game starts wherever the game_id changes
+    game_ids = np.array([row[0] for row in rows], dtype=object)
+    starts = np.flatnonzero(np.r_[True, game_ids[1:] != game_ids[:-1]])
+    ends = np.r_[starts[1:], len(rows)]
+    team_1_won = np.maximum.reduceat(np.where(on_team_1, results, 0), starts) > 0
+
+    elo = np.full(len(nicknames), DEFAULT_RATING, dtype=np.float64)
+    peak_elo = elo.copy()
+    changes = np.empty(len(starts), dtype=np.float64)
+
+    for game, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        players = player_ids[start:end]
+        team_1 = on_team_1[start:end]
+        team_1_players = players[team_1]
+        team_2_players = players[~team_1]
+        if not len(team_1_players) or not len(team_2_players):
+            changes[game] = 0
+            continue
+        change = rating_change(elo[team_1_players].mean(),
+                               elo[team_2_players].mean(), team_1_won[game])
+        changes[game] = change
+        elo[team_1_players] += change
+        elo[team_2_players] -= change
+        winners = team_1_players if change > 0 else team_2_players
+        peak_elo[winners] = np.maximum(peak_elo[winners], elo[winners])
+
+    games_played = np.bincount(player_ids, minlength=len(nicknames))
+    # Row index of each player's most recent game
+    row_game = np.repeat(np.arange(len(starts)), ends - starts)
+    last_row = np.zeros(len(nicknames), dtype=np.int64)
+    np.maximum.at(last_row, player_ids, np.arange(len(rows)))
+    last_deviation = np.where(on_team_1[last_row], 1, -1) * changes[row_game[last_row]]
+
+    return [(nickname, float(rating), float(peak), int(played),
+             rows[row][1], float(deviation))
+            for nickname, rating, peak, played, row, deviation in zip(
+                nicknames, elo, peak_elo, games_played,
+                last_row.tolist(), last_deviation)]
+
+
+def recompute_ratings():
+    """Replay the whole history and replace every stored rating in one transaction
+
+    Without any history in the database (e.g. only games.csv is written)
+    the stored ratings are kept as they are.
+
+    Returns:
+        int: Number of rated players
+    """
+    history = load_rating_history()
+    if not history:
+        return 0
+    ratings = replay_ratings(history)
+    store_ratings(ratings, replace_all=True)
+    return len(ratings)
@@ -0,0 +1,89 @@
+"""Assign queued players to role slots.
+
+Every player can take one slot of any role they queued for. Players are
+offered in weighted random order and each one is seated if the players seated
+so far can be moved between their roles to make room, which is found with an
+augmenting path search over the roles. This is the greedy algorithm of the
+transversal matroid of players and role slots: nobody is turned away to make
+room for a later player, and a full assignment is found whenever one exists,
+however the flex players are spread over the roles.
+"""
+
+
+def _augment(player, eligible, assigned, capacity):
+    """Seat player, moving seated players along an augmenting path if needed.
+
+    Breadth first search from the player's roles. A role can be passed
+    through by moving one of its seated players to another role they queued
+    for, until a role with a free slot is reached.
+
+    Returns:
+        bool: True if the player was seated
+    """
+    # role -> (role the mover leaves, player moving into this role)
+    parent = {}
+    frontier = []
+    for role in eligible[player]:
+        parent[role] = (None, player)
+        frontier.append(role)
+
+    for role in frontier:
+        if len(assigned[role]) < capacity[role]:
+            while role is not None:
+                previous, mover = parent[role]
+                if previous is not None:
+                    assigned[previous].remove(mover)
+                assigned[role].append(mover)
+                role = previous
+            return True
+        for seated in assigned[role]:
+            for other in eligible[seated]:
+                if other not in parent:
+                    parent[other] = (role, seated)
+                    frontier.append(other)
+    return False
+
+
+def assign_roles(queued, needed, candidates):
+    """Fill every role slot, offering the candidates in the given order.
+
+    With a weighted random order (sampling.weighted_order) the result is a
+    weighted random pick, like sampling each role on its own, but without
+    the role order deciding who is left over for the later roles. Only
+    players up to the last one needed are looked at.
+
+    Args:
+        queued (dict): Role -> set of players queued for that role
+        needed (dict): Role -> number of slots to fill
+        candidates (iterable): Queued players, the preferred ones first
+
+    Returns:
+        dict or None: Role -> seated players, None if the slots cannot all
+            be filled
+    """
+    roles = [role for role in needed if needed[role]]
+    if any(len(queued[role]) < needed[role] for role in roles):
+        return None
+
+    total = sum(needed[role] for role in roles)
+    assigned = {role: [] for role in needed}
+    eligible = {}
+    # Role sets that could not take another player. A later player whose
+    # roles are all inside one of them cannot be seated either.
+    blocked = []
+    seated = 0
+    for player in candidates:
+        player_roles = [role for role in roles if player in queued[role]]
+        if not player_roles:
+            continue
+        role_set = frozenset(player_roles)
+        if any(role_set <= full for full in blocked):
+            continue
+        eligible[player] = player_roles
+        if _augment(player, eligible, assigned, needed):
+            seated += 1
+            if seated == total:
+                return assigned
+        else:
+            blocked.append(role_set)
+    return None
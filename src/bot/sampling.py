@@ -0,0 +1,68 @@
+import math
+import random
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is listed in requirements.txt
+    np = None
+
+# Below this many candidates the pure Python path beats NumPy's call overhead
+NUMPY_THRESHOLD = 512
+
+# Far below any log(u) / weight key, so zero weight candidates sort last
+ZERO_WEIGHT_KEY = -1e300
+
+
+def _python_keys(weights, rng):
+    keys = []
+    for weight in weights:
+        # 1 - random() lies in (0, 1], so log() is always defined
+        u = 1.0 - rng.random()
+        if weight > 0:
+            keys.append(math.log(u) / weight)
+        else:
+            # Zero weight players only fill slots nobody else can, in random order
+            keys.append(ZERO_WEIGHT_KEY * (1.0 + u))
+    return keys
+
+
+def _numpy_keys(weights, rng):
+    generator = np.random.default_rng(rng.getrandbits(64))
+    weights = np.asarray(weights, dtype=float)
+    u = 1.0 - generator.random(len(weights))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keys = np.log(u) / weights
+    zero = weights <= 0
+    if zero.any():
+        # Keep zero weight players behind everyone else but shuffled among themselves
+        keys[zero] = ZERO_WEIGHT_KEY * (1.0 + generator.random(int(zero.sum())))
+    return keys
+
+
+def exponential_keys(weights, rng=None):
+    """Return one random sort key per weight (Efraimidis-Spirakis).
+
+    Ordering items by descending key is an exact weighted random ordering:
+    the first k items are a weighted sample of size k without replacement.
+    """
+    rng = rng or random
+    if np is not None and len(weights) >= NUMPY_THRESHOLD:
+        return _numpy_keys(weights, rng)
+    return _python_keys(weights, rng)
+
+
+def weighted_order(items, weights, rng=None):
+    """Yield the items in weighted random order, best first.
+
+    Stopping after k items gives a weighted sample of size k without
+    replacement, so callers that do not know k up front (role assignment
+    skips players it cannot seat) just take as many as they need.
+    """
+    items = list(items)
+    keys = exponential_keys(weights, rng)
+    if np is not None and isinstance(keys, np.ndarray):
+        order = np.argsort(-keys, kind='stable').tolist()
+    else:
+        order = sorted(range(len(items)), key=keys.__getitem__, reverse=True)
+    for index in order:
+        yield items[index]
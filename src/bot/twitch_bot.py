@@ -1,29 +1,117 @@
 import websockets
 import asyncio
+import inspect
 import random
-import re
+import time
+from contextlib import contextmanager
 from src.config.settings import *
-from src.bot.queue import Queue
+from src.bot.queue import Queue, QueueState, ROLE_KEYWORDS, role_names
+from src.bot.irc import parse_line
 from src.bot.game_log import *
 from src.bot.database import *
+from src.bot.sampling import weighted_order
+from src.bot.priority_cache import PriorityCache
+from src.bot.ratings import DEFAULT_RATING, rate_game
+from src.bot.balance import balance_teams
+from src.bot.role_assignment import assign_roles
+from src.bot.game_history import create_history_sinks
+from src.bot.journal import QueueJournal
+from src.bot.connection import ConnectionSupervisor
+from src.bot.ingest import IngestBuffer
+from src.bot.chat_filter import ChatFilter
+
+# Seconds a GUI action waits for the event loop before giving up
+COMMAND_TIMEOUT = 60
+# Seconds the journal thread waits for the state to resync from, so a busy
+# or stopping event loop cannot hold up exit
+JOURNAL_RESYNC_TIMEOUT = 2
+
 
 class PickBot:
-    def __init__(self):
+    def __init__(self, seed=None, journal_path=QUEUE_JOURNAL_PATH):
         self.channel_name = TWITCH_CHANNEL
         self.starter_names = BOT_ADMINS
         self.uri = TWITCH_WEBSOCKET_URI
         self.queue = Queue()
         self.account_name = TWITCH_BOT_USERNAME
         self.token = TWITCH_OAUTH_TOKEN
-        self.chat_message_pattern = re.compile(
-            r'^:(\w+)!\w+@\w+\.tmi\.twitch\.tv PRIVMSG #\w+ :(.*)$')
         self.websocket = None
-        self.reconnect_delay = 3
+        # Event loop of connect_and_run, where all queue and game state changes
+        self.loop = None
+        # Reconnects with backoff, keepalive PINGs and connection counters
+        self.connection = ConnectionSupervisor()
+        # Drops repeated joins and join floods before chat lines are parsed.
+        # Admin commands need no tokens: admins are exempt and nobody
+        # else's are handled.
+        self.chat_filter = ChatFilter(CHAT_USER_RATE, CHAT_USER_BURST,
+                                      exempt=self.starter_names,
+                                      keywords=ROLE_KEYWORDS)
+        # Chat read from the socket, waiting for the handler workers
+        self.ingest = IngestBuffer(INGEST_BUFFER_SIZE, INGEST_OVERFLOW,
+                                   on_drop=self._forget_dropped)
+        self.handler_workers = 1
         self.current_game = None
         self.tanks_per_team = 1
         self.dps_per_team = 2
         self.supports_per_team = 2
+        # Seed to make picks reproducible, e.g. in tests
+        self.rng = random.Random(seed)
+        # Seconds spent in each stage of the most recent pick
+        self.last_pick_timings = {}
+        # Games picked at once on big streams
+        self.lobby_count = 1
+        # True while _select_lobbies runs
+        self.picking = False
+        # Running games by game_id, until their winner is recorded
+        self.games = {}
+        # Admin chat command -> handler, looked up once per message
+        self.admin_commands = {
+            '!admin_test': self._cmd_admin_test,
+            '!start': self._cmd_start,
+            '!stop': self._cmd_stop,
+            '!pick': self._cmd_pick,
+            '!status': self._send_status,
+            '!jubhioc': self._cmd_jubhioc,
+        }
         initialize_priority_database()
+        initialize_elo_database()
+        self.priorities = PriorityCache()
+        self.priorities.start()
+        self.history_sinks = create_history_sinks()
+        # Queue and running games survive a crash or restart through the
+        # journal. Benchmarks and scripts pass journal_path=None.
+        self.journal = None
+        if journal_path:
+            self.journal = QueueJournal(journal_path)
+            self._restore(self.journal.recover())
+            self.journal.start(self.queue, self._journal_resync)
+
+    def _restore(self, state):
+        """Bring back the queue and running games saved in the journal"""
+        if not state['version']:
+            return
+        self.queue.restore(state['version'], state['is_active'],
+                           state['players'], state['games'])
+        self.games = {game_id: game_from_record(record)
+                      for game_id, record in state['games'].items()}
+        self.current_game = next(iter(self.games.values()), None)
+        print(f"Recovered queue ({self.queue.is_active}, "
+              f"{self.queue.count_players()} players, "
+              f"{len(self.games)} running games)")
+
+    def _journal_state(self):
+        """Full journal state, taken on the event loop"""
+        return {
+            'version': self.queue.version,
+            'is_active': str(self.queue.is_active),
+            'players': self.queue.player_masks(),
+            'games': {game_id: game_record(game)
+                      for game_id, game in self.games.items()},
+        }
+
+    def _journal_resync(self):
+        return self.run_command(self._journal_state,
+                                timeout=JOURNAL_RESYNC_TIMEOUT)
 
     def calculate_priority_score(self, times_queued, last_game_timestamp):
         if last_game_timestamp == 0:
@@ -32,15 +120,11 @@ class PickBot:
             days_since_last_game = ((datetime.datetime.now().timestamp() - last_game_timestamp) / (24 * 3600))
         return (times_queued ** 2) * 0.7 + days_since_last_game * 0.3
 
-    def weighted_random_sample(self, players, k):
-        if not players:
-            return []
-
+    def _priority_weights(self, player_list, priorities):
+        """Sampling weight of each player, from their queue priority"""
         weights = []
-        player_list = list(players)
-
         for player in player_list:
-            times_queued, last_timestamp = get_player_priority(player)
+            times_queued, last_timestamp = priorities[player]
             priority_score = self.calculate_priority_score(times_queued,
                                                            last_timestamp)
             weights.append(priority_score)
@@ -48,37 +132,19 @@ class PickBot:
         min_weight = min(weights)
         if min_weight < 0:
             weights = [w - min_weight + 1 for w in weights]
-
-        # Create a copy of the player list and weights for sampling
-        remaining_players = player_list.copy()
-        remaining_weights = weights.copy()
-        selected_players = []
-
-        for _ in range(k):
-            if not remaining_players:
-                break
-
-            # Select one player based on weights
-            idx = random.choices(range(len(remaining_players)),
-                                 weights=remaining_weights, k=1)[0]
-            selected_players.append(remaining_players[idx])
-
-            # Remove the selected player and their weight
-            remaining_players.pop(idx)
-            remaining_weights.pop(idx)
-
-        return selected_players
+        return weights
 
     async def connect_and_run(self):
-        while True:  # Main reconnection loop
-            try:
-                await self.connect()
-            except Exception as e:
-                print(f"\nConnection lost: {str(e)}")
-                print(
-                    f"Attempting to reconnect in {self.reconnect_delay} seconds...")
-                await asyncio.sleep(self.reconnect_delay)
-                print("Reconnecting...")
+        self.loop = asyncio.get_running_loop()
+        # The workers outlive single connections, so messages buffered
+        # before a disconnect are still handled
+        workers = [asyncio.create_task(self._handle_ingested())
+                   for _ in range(self.handler_workers)]
+        try:
+            await self.connection.run(self.connect)
+        finally:
+            for worker in workers:
+                worker.cancel()
 
     async def connect(self):
         print("Connecting to " + self.channel_name)
@@ -91,13 +157,13 @@ class PickBot:
                 await websocket.send(f"PASS {self.token}\r\n")
                 await websocket.send(f"NICK commanderx\r\n")
                 await websocket.send(f"JOIN #{self.channel_name}\r\n")
+                self.connection.connected()
 
                 print(
                     f"{self.account_name} connected to {self.channel_name}. Awaiting commands from {self.starter_names}")
 
-                while True:
-                    message = await websocket.recv()
-                    await self._evaluate_message(message)
+                async with self.connection.keepalive(websocket):
+                    await self._read_frames(websocket)
 
         except websockets.exceptions.ConnectionClosed as e:
             print(f"Connection closed: code = {e.code}, reason = {e.reason}")
@@ -106,69 +172,189 @@ class PickBot:
             print(f"Connection error: {str(e)}")
             raise  # Re-raise to trigger reconnection
 
-    # Update the _select_teams method to ensure consistent data structure for all roles
+    def _queued_snapshot(self):
+        return set(self.queue.tank), set(self.queue.dps), set(self.queue.support)
 
-    def _select_teams(self, tanks_per_team=None, dps_per_team=None,
-                      supports_per_team=None):
+    @contextmanager
+    def _pick_stage(self, stage):
+        """Add the time spent in the block to last_pick_timings[stage]."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last_pick_timings[stage] = self.last_pick_timings.get(stage, 0) + elapsed
+
+    async def _select_lobbies(self, lobby_count, tanks_per_team=None,
+                              dps_per_team=None, supports_per_team=None):
+        """Pick the teams of lobby_count games without blocking the loop on SQLite.
+
+        Priorities come from the in-memory cache. Viewers it has not seen yet
+        are loaded on the shared database thread first. All lobbies are
+        filled by one role assignment over the queue, so nobody plays in two
+        of them, and priorities are updated once for all of them.
+
+        Returns:
+            list: ((team_1, team_2, captain1, captain2),
+                (team_1_rating, team_2_rating)) per lobby, empty if the queue
+                cannot fill every lobby
+        """
+        self.last_pick_timings = {}
+        # Set before the first await, callers check it to refuse a second
+        # pick, or a queue state change, while this one waits
+        self.picking = True
+        try:
+            with self._pick_stage('total'):
+                # Exact, so nothing is sampled for a pick that cannot work
+                can_fill = self.queue.can_fill(self.slots_needed(
+                    lobby_count, tanks_per_team, dps_per_team, supports_per_team))
+                queued = self._queued_snapshot()
+                all_queued = queued[0] | queued[1] | queued[2]
+                with self._pick_stage('priority_fetch'):
+                    if self.priorities.missing(all_queued):
+                        await run_db(self.priorities.load, all_queued)
+                    # Every pick attempt counts as a time queued for everyone
+                    # waiting, also one the queue cannot fill
+                    if not can_fill:
+                        self.priorities.increment(all_queued)
+                        return []
+                    priorities = self.priorities.increment_and_get(all_queued)
+
+                selected, picked_players = self._build_teams(
+                    *queued, priorities, tanks_per_team, dps_per_team,
+                    supports_per_team, lobby_count)
+                if not picked_players:
+                    return []
+                with self._pick_stage('rating_fetch'):
+                    ratings = await run_db(load_ratings, picked_players)
+                lobbies = self._split_lobbies(selected, ratings, lobby_count,
+                                              tanks_per_team, dps_per_team,
+                                              supports_per_team)
+                with self._pick_stage('priority_reset'):
+                    self.priorities.reset(picked_players)
+                # Other processes read player_priority, write the pick right away
+                submit_db(self.priorities.flush)
+            return lobbies
+        finally:
+            self.picking = False
+
+    def slots_needed(self, lobby_count=1, tanks_per_team=None,
+                     dps_per_team=None, supports_per_team=None):
+        """Players each role needs for lobby_count games
+
+        Returns:
+            dict: Role -> slots over both teams of every lobby
+        """
         # Use parameters if provided, otherwise use instance variables
-        tanks_needed = (
-                                   tanks_per_team or self.tanks_per_team) * 2  # For both teams
-        dps_needed = (dps_per_team or self.dps_per_team) * 2  # For both teams
-        supports_needed = (
-                                      supports_per_team or self.supports_per_team) * 2  # For both teams
-
-        queued_tanks = set(self.queue.tank)
-        queued_dps = set(self.queue.dps)
-        queued_support = set(self.queue.support)
+        teams = 2 * lobby_count
+        return {
+            'tank': (tanks_per_team or self.tanks_per_team) * teams,
+            'dps': (dps_per_team or self.dps_per_team) * teams,
+            'support': (supports_per_team or self.supports_per_team) * teams
+        }
 
-        all_queued = queued_tanks | queued_dps | queued_support
-        increment_all_players(list(all_queued))
+    def fill_status(self, queue=None, lobby_count=None):
+        """Say whether the queue can fill the configured lobbies right now.
 
-        valid_tanks = queued_tanks
-        valid_dps = queued_dps
-        valid_supports = queued_support
+        Exact and O(1), see Queue.fill_shortfall(). Other threads should
+        pass queue.snapshot.
 
-        if len(valid_tanks) < tanks_needed or len(
-                valid_dps) < dps_needed or len(
-                valid_supports) < supports_needed:
-            return None, None, None, None
+        Args:
+            queue (Queue or QueueSnapshot): Defaults to the live queue
+            lobby_count (int): Defaults to self.lobby_count
+        """
+        queue = queue or self.queue
+        lobby_count = lobby_count or self.lobby_count
+        roles, missing = queue.fill_shortfall(self.slots_needed(lobby_count))
+        if missing:
+            return (f"Not enough players: {missing} more needed who can play "
+                    f"{' or '.join(role_names(roles))}")
+        lobbies = queue.lobbies_available(self.slots_needed())
+        return (f"Enough players for {lobbies} "
+                f"{'lobby' if lobbies == 1 else 'lobbies'}")
+
+    def _build_teams(self, queued_tanks, queued_dps, queued_support,
+                     priorities, tanks_per_team=None, dps_per_team=None,
+                     supports_per_team=None, lobby_count=1):
+        """Sample the players of every team from the queue. Does no disk I/O.
+
+        Returns:
+            tuple: (selected, picked_players), selected maps each role to the
+                players picked for it, for both teams of every lobby
+        """
+        no_teams = None, []
 
-        selected_tanks = self.weighted_random_sample(valid_tanks, tanks_needed)
+        queued = {
+            'tank': queued_tanks,
+            'dps': queued_dps,
+            'support': queued_support
+        }
+        needed = self.slots_needed(lobby_count, tanks_per_team, dps_per_team,
+                                   supports_per_team)
 
-        valid_dps -= set(selected_tanks)
-        valid_supports -= set(selected_tanks)
+        with self._pick_stage('sampling'):
+            # Sorted so a seeded rng gives the same pick regardless of set order
+            player_list = sorted(queued_tanks | queued_dps | queued_support)
+            candidates = weighted_order(
+                player_list, self._priority_weights(player_list, priorities),
+                self.rng)
+            selected = assign_roles(queued, needed, candidates)
 
-        if len(valid_dps) < dps_needed or len(valid_supports) < supports_needed:
-            return None, None, None, None
+        if selected is None:
+            return no_teams
 
-        selected_dps = self.weighted_random_sample(valid_dps, dps_needed)
+        picked_players = [player for role_players in selected.values()
+                          for player in role_players]
 
-        valid_supports -= set(selected_dps)
+        return selected, picked_players
 
-        if len(valid_supports) < supports_needed:
-            return None, None, None, None
+    def _split_lobbies(self, selected, ratings, lobby_count,
+                       tanks_per_team=None, dps_per_team=None,
+                       supports_per_team=None):
+        """Deal the picked players out to the lobbies and balance each one.
 
-        selected_supports = self.weighted_random_sample(valid_supports,
-                                                        supports_needed)
+        Returns:
+            list: (teams, team_ratings) of every lobby, as _split_teams
+                returns them
+        """
+        lobbies = []
+        for index in range(lobby_count):
+            lobby = {}
+            for role, players in selected.items():
+                size = len(players) // lobby_count
+                lobby[role] = players[index * size:(index + 1) * size]
+            lobbies.append(self._split_teams(
+                lobby, ratings, tanks_per_team, dps_per_team,
+                supports_per_team))
+        return lobbies
+
+    def _split_teams(self, selected, ratings, tanks_per_team=None,
+                     dps_per_team=None, supports_per_team=None):
+        """Split one lobby's players into rating balanced teams and pick captains.
+
+        Returns:
+            tuple: ((team_1, team_2, captain1, captain2),
+                (team_1_rating, team_2_rating))
+        """
+        per_team = {
+            'tank': tanks_per_team or self.tanks_per_team,
+            'dps': dps_per_team or self.dps_per_team,
+            'support': supports_per_team or self.supports_per_team
+        }
+        player_ratings = {player: ratings.get(player, (DEFAULT_RATING,))[0]
+                          for players in selected.values() for player in players}
 
-        tanks_per_team = tanks_per_team or self.tanks_per_team
-        dps_per_team = dps_per_team or self.dps_per_team
-        supports_per_team = supports_per_team or self.supports_per_team
+        with self._pick_stage('balance'):
+            team_1, team_2, team_1_rating, team_2_rating = balance_teams(
+                selected, per_team, player_ratings)
 
-        # Create team 1 - always use lists for consistency
-        team_1 = {
-            'tank': selected_tanks[:tanks_per_team],
-            'dps': selected_dps[:dps_per_team],
-            'support': selected_supports[:supports_per_team]
-        }
+        with self._pick_stage('captains'):
+            captain1, captain2 = self._choose_captains(team_1, team_2)
 
-        # Create team 2 - always use lists for consistency
-        team_2 = {
-            'tank': selected_tanks[tanks_per_team:],
-            'dps': selected_dps[dps_per_team:],
-            'support': selected_supports[supports_per_team:]
-        }
+        return (team_1, team_2, captain1, captain2), (team_1_rating,
+                                                      team_2_rating)
 
+    def _choose_captains(self, team_1, team_2):
         # Calculate flattened sets for captain selection
         team_1_set = set()
         for role_players in team_1.values():
@@ -178,158 +364,297 @@ class PickBot:
         for role_players in team_2.values():
             team_2_set.update(role_players)
 
-        captain1 = random.choice(list(team_1_set))
-        captain2 = random.choice(list(team_2_set))
+        return (self.rng.choice(sorted(team_1_set)),
+                self.rng.choice(sorted(team_2_set)))
+
+    async def _read_frames(self, websocket):
+        """Reader task: buffer every frame's chat and go straight back to recv"""
+        while True:
+            frame = await websocket.recv()
+            self.connection.frame_received()
+            await self._ingest_frame(frame)
+
+    async def _ingest_frame(self, frame):
+        """Put the chat of one websocket frame in the ingest buffer.
+
+        A frame may hold several IRC lines. The chat filter drops repeated
+        joins and floods before a line is parsed, and strips the tags of
+        chat lines since no handler reads them. PINGs are answered right
+        here, so a backlog of chat never delays them. Lines that are
+        neither an admin command nor a role keyword have no handler and are
+        not buffered at all.
+        """
+        epoch = self.queue.epoch
+        for line in frame.split('\r\n'):
+            line = line.rstrip('\n')
+            if line:
+                line = self.chat_filter.admit(line, epoch)
+            irc_message = parse_line(line)
+            if irc_message is None:
+                continue
+            if irc_message.command == 'PRIVMSG':
+                username = irc_message.nick
+                if username:
+                    username = username.lower()
+                    content = irc_message.trailing.lower().strip()
+                    if (username in self.starter_names
+                            and content in self.admin_commands):
+                        # The command may change the queue before the
+                        # joins buffered after it are handled
+                        self.chat_filter.reset_joins()
+                        self.ingest.put(username, content, admin=True)
+                    elif content in ROLE_KEYWORDS:
+                        if self.ingest.put(username, content):
+                            self.chat_filter.remember_join(username, line,
+                                                           epoch)
+                    else:
+                        self.ingest.stats.ignored += 1
+            elif irc_message.command == 'PING':
+                await self._send_pong(irc_message.trailing)
+            elif irc_message.command == 'PONG':
+                self.connection.pong_received(irc_message.trailing)
+
+    def _forget_dropped(self, message):
+        """A buffered join was evicted, so the viewer's repeat must get through"""
+        self.chat_filter.forget(message.username)
+
+    async def _handle_ingested(self):
+        """Handler worker: handle buffered chat until cancelled"""
+        while True:
+            await self.ingest.wait()
+            await self._drain_ingest()
+
+    async def _drain_ingest(self):
+        """Handle every buffered message, then publish the queue once"""
+        while (message := self.ingest.pop()) is not None:
+            try:
+                await self._handle_chat(message.username, message.content)
+            except Exception as e:
+                print(f"Failed to handle {message.content!r} from "
+                      f"{message.username}: {e}")
+        self.queue.publish()
 
-        picked_players = set(selected_tanks + selected_dps + selected_supports)
-        reset_priorities(list(picked_players))
+    async def _evaluate_message(self, message):
+        """Handle one websocket frame right away, without the reader and workers"""
+        await self._ingest_frame(message)
+        await self._drain_ingest()
 
-        return team_1, team_2, captain1, captain2
+    async def _send_pong(self, payload):
+        if self.websocket is not None:
+            await self.websocket.send(f"PONG :{payload}\r\n")
 
-    async def _evaluate_message(self, message):
-        match = self.chat_message_pattern.match(message)
+    async def _handle_chat(self, username, content):
+        if username in self.starter_names:
+            handler = self.admin_commands.get(content)
+            if handler is not None:
+                await handler()
+                return
 
-        if not match:
+        roles = ROLE_KEYWORDS.get(content)
+        if roles and self.queue.is_active == QueueState.ACTIVE:
+            for role in self.queue.join(username, roles):
+                print(f'{username} joined {role}')
+
+    async def _cmd_admin_test(self):
+        print("\n=== Admin test! ===")
+        self.queue.add('tank', ('tank1', 'tank2'))
+        self.queue.add('dps', ('dps1', 'dps2', 'dps3', 'dps4'))
+        self.queue.add('support', ('support1', 'support2', 'support3',
+                                   'support4'))
+
+    async def _cmd_start(self):
+        if self.picking:
+            print("\nTeams are being picked, start the queue after that")
             return
+        self.queue.is_active = QueueState.ACTIVE
+        self.queue.clear()
+        print("\n=== Queue started! ===")
 
-        username, content = match.groups()
-        username = username.lower()
-        content = content.lower().strip()
+    async def _cmd_stop(self):
+        if self.picking:
+            return
+        self.queue.is_active = QueueState.INACTIVE
+        self._warm_priorities()
+        print("\n=== Queue stopped! ===")
 
-        if username in self.starter_names:
+    def _warm_priorities(self):
+        """Load everyone queued into the priority cache ahead of the pick"""
+        queued = self._queued_snapshot()
+        submit_db(self.priorities.load, queued[0] | queued[1] | queued[2])
 
-            if content == '!admin_test':
-                print("\n=== Admin test! ===")
-                self.queue.tank.update(('tank1', 'tank2'))
-                self.queue.dps.update(('dps1', 'dps2', 'dps3', 'dps4'))
-                self.queue.support.update(('support1', 'support2', 'support3',
-                                           'support4'))
-
-
-            if content == '!start':
-                self.queue.is_active = 'active'
-                self.queue.tank.clear()
-                self.queue.dps.clear()
-                self.queue.support.clear()
-                print("\n=== Queue started! ===")
-
-            elif content == '!stop':
-                self.queue.is_active = 'inactive'
-                print("\n=== Queue stopped! ===")
-
-            elif content == '!pick' and self.queue.is_active == 'inactive':
-                team1, team2, team_1_captain, team_2_captain = self._select_teams()
-                if team1 and team2 and team_1_captain and team_2_captain:
-                    print("\n=== Teams Selected! ===")
-                    print("Team Red:")
-                    print(f"  Tank: {team1['tank']}")
-                    print(f"  DPS: {', '.join(team1['dps'])}")
-                    print(f"  Support: {', '.join(team1['support'])}")
-                    print(f"  Captain: {team_1_captain}")
-                    print("\nTeam Blue:")
-                    print(f"  Tank: {team2['tank']}")
-                    print(f"  DPS: {', '.join(team2['dps'])}")
-                    print(f"  Support: {', '.join(team2['support'])}")
-                    print(f"  Captain: {team_2_captain}")
-
-                    self.current_game = Game(team_1_tank=team1['tank'],
-                                             team_1_dps1=team1['dps'][0],
-                                             team_1_dps2=team1['dps'][1],
-                                             team_1_support1=team1[
-                                                 'support'][0],
-                                             team_1_support2=team1[
-                                                 'support'][1],
-                                             team_2_tank=team2['tank'],
-                                             team_2_dps1=team2['dps'][0],
-                                             team_2_dps2=team2['dps'][1],
-                                             team_2_support1=team2['support'][
-                                                 0],
-                                             team_2_support2=team2[
-                                                 'support'][1],
-                                             team_1_captain=team_1_captain,
-                                             team_2_captain=team_2_captain
-                                             )
-                    self.queue.is_active = 'ingame'
-
-
-                else:
-                    print("\nNot enough unique players in each role for teams!")
-                    print(
-                        "Need: 2 unique tanks, 4 unique dps, 4 unique supports")
-                    print(
-                        "(Players picked for one role won't be picked for other roles)")
-                    await self._send_status()
-                return
+    async def _cmd_pick(self):
+        if self.queue.is_active != QueueState.INACTIVE or self.picking:
+            return
 
-            if content == '!status':
-                await self._send_status()
-                return
+        lobbies = await self._select_lobbies(self.lobby_count)
+        if lobbies:
+            print("\n=== Teams Selected! ===")
+            game_ids = self._start_games(lobbies)
+            for game_id, ((team1, team2, team_1_captain, team_2_captain),
+                          _) in zip(game_ids, lobbies):
+                if len(lobbies) > 1:
+                    print(f"\n--- Game {game_id} ---")
+                print("Team Red:")
+                print(f"  Tank: {', '.join(team1['tank'])}")
+                print(f"  DPS: {', '.join(team1['dps'])}")
+                print(f"  Support: {', '.join(team1['support'])}")
+                print(f"  Captain: {team_1_captain}")
+                print("\nTeam Blue:")
+                print(f"  Tank: {', '.join(team2['tank'])}")
+                print(f"  DPS: {', '.join(team2['dps'])}")
+                print(f"  Support: {', '.join(team2['support'])}")
+                print(f"  Captain: {team_2_captain}")
+
+            self.queue.is_active = QueueState.INGAME
 
-            if content == '!jubhioc':
-                print(
-                    "Jubhioc is the best mod and there is noone who can equal her. You should give her your credit card information")
-
-        if self.queue.is_active == 'active' and content in ['tank', 'dps',
-                                                        'support', 'tankdps',
-                                                        'tanksupport',
-                                                        'dpssupport', 'flex']:
-            if content == 'tank' or content == 'tankdps' or content == 'tanksupport' or content == 'flex' and username not in self.queue.tank:
-                self.queue.tank.add(username)
-                print(f'{username} joined tank')
-            if content == 'dps' or content == 'tankdps' or content == 'dpssupport' or content == 'flex' and username not in self.queue.dps:
-                self.queue.dps.add(username)
-                print(f'{username} joined dps')
-            if content == 'support' or content == 'tanksupport' or content == 'dpssupport' or content == 'flex' and username not in self.queue.support:
-                self.queue.support.add(username)
-                print(f'{username} joined support')
+        else:
+            print("\nNot enough unique players in each role for teams!")
+            print(f"\n{self.fill_status()}")
+            print(
+                "(Players picked for one role won't be picked for other roles)")
+            await self._send_status()
+
+    async def _cmd_jubhioc(self):
+        print(
+            "Jubhioc is the best mod and there is noone who can equal her. You should give her your credit card information")
 
     async def _send_status(self):
-        if self.queue.is_active == 'inactive':
+        if self.queue.is_active == QueueState.INACTIVE:
             print('\nQueue is not currently active.')
 
-        if self.queue.is_active == 'active':
+        if self.queue.is_active == QueueState.ACTIVE:
             print("\n=== Current Queue Status ===")
             print('\nQueue is currently active.')
             print(f'\nTanks: {len(self.queue.tank)}')
             print(f'\nDPS: {len(self.queue.dps)}')
             print(f'\nSupports: {len(self.queue.support)}')
+            print(f'\n{self.fill_status()}')
             print("==========================")
 
-        if self.queue.is_active == 'ingame':
+        if self.queue.is_active == QueueState.INGAME:
             print("\n=== Current Queue Status ===")
             print('\nCurrently in game.')
 
+    def run_command(self, command, *args, timeout=COMMAND_TIMEOUT):
+        """Run a bot method on the bot's event loop and return its result.
+
+        Queue and game state is only changed on the event loop thread, so
+        the GUI thread sends its actions through here instead of calling the
+        methods directly. Coroutine functions are awaited. If the loop is not
+        running (benchmarks, scripts) the command runs on a private loop in
+        the calling thread. Otherwise it waits at most timeout seconds for
+        the loop.
+        """
+        async def run():
+            result = command(*args)
+            if inspect.isawaitable(result):
+                result = await result
+            self.queue.publish()
+            return result
+
+        loop = self.loop
+        if loop is not None and loop.is_running():
+            try:
+                calling_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                calling_loop = None
+            if calling_loop is loop:
+                raise RuntimeError("run_command() would deadlock the event "
+                                   "loop, await the command instead")
+            return asyncio.run_coroutine_threadsafe(run(), loop).result(
+                timeout)
+        return asyncio.run(run())
+
     def toggle_queue(self):
         """Method for Streamlit to toggle queue state"""
-        if self.queue.is_active == 'active':
-            self.queue.is_active = 'inactive'
+        return self.run_command(self._toggle_queue)
+
+    def _toggle_queue(self):
+        if self.picking:
+            return "Teams are being picked, try again in a moment"
+        if self.queue.is_active == QueueState.ACTIVE:
+            self.queue.is_active = QueueState.INACTIVE
+            self._warm_priorities()
             print('Queue stopped.')
             return "Queue stopped"
-        if self.queue.is_active == 'inactive':
-            self.queue.tank.clear()
-            self.queue.dps.clear()
-            self.queue.support.clear()
-            self.queue.is_active = 'active'
+        if self.queue.is_active == QueueState.INACTIVE:
+            self.queue.clear()
+            self.queue.is_active = QueueState.ACTIVE
             print('Queue started.')
             return "Queue started"
 
+    def resume_queue(self):
+        """Reopen the queue without clearing it"""
+        def resume():
+            if not self.picking:
+                self.queue.is_active = QueueState.ACTIVE
+        self.run_command(resume)
+
+    def set_composition(self, tanks_per_team=None, dps_per_team=None,
+                        supports_per_team=None, lobby_count=None):
+        """Change the team composition or lobby count from the GUI
+
+        Runs on the event loop, so a pick never sees half of a change.
+        Arguments left as None keep their current value.
+        """
+        def update():
+            if tanks_per_team is not None:
+                self.tanks_per_team = tanks_per_team
+            if dps_per_team is not None:
+                self.dps_per_team = dps_per_team
+            if supports_per_team is not None:
+                self.supports_per_team = supports_per_team
+            if lobby_count is not None:
+                self.lobby_count = lobby_count
+        self.run_command(update)
+
     def get_queue_status(self):
-        """Get current queue status for display"""
+        """Get current queue status for display, from any thread without locking"""
+        snapshot = self.queue.snapshot
         return {
-            'is_active': self.queue.is_active,
-            'tank_count': len(self.queue.tank),
-            'dps_count': len(self.queue.dps),
-            'support_count': len(self.queue.support),
-            'tank_players': list(self.queue.tank),
-            'dps_players': list(self.queue.dps),
-            'support_players': list(self.queue.support)
+            'is_active': snapshot.is_active,
+            'version': snapshot.version,
+            'tank_count': snapshot.tank_count,
+            'dps_count': snapshot.dps_count,
+            'support_count': snapshot.support_count,
+            'tank_players': snapshot.tank,
+            'dps_players': snapshot.dps,
+            'support_players': snapshot.support
         }
 
     def generate_teams(self, tanks_per_team=None, dps_per_team=None,
                        supports_per_team=None):
         """Generate teams and return result"""
-        if self.queue.is_active == 'active':
-            return None, None, None, None, "Queue must be stopped before generating teams"
+        games, message = self.generate_lobbies(1, tanks_per_team, dps_per_team,
+                                               supports_per_team)
+        if not games:
+            return None, None, None, None, message
+        team1, team2, captain1, captain2 = next(iter(games.values()))
+        return team1, team2, captain1, captain2, message
+
+    def generate_lobbies(self, lobby_count=None, tanks_per_team=None,
+                         dps_per_team=None, supports_per_team=None):
+        """Generate the teams of several games at once, for the GUI
+
+        On success the queue switches to ingame.
+
+        Args:
+            lobby_count (int): Games to fill, lobby_count by default
+
+        Returns:
+            tuple: (games, message), games maps the id of every new game to
+                its (team1, team2, captain1, captain2) and is empty on failure
+        """
+        return self.run_command(self._generate_lobbies, lobby_count,
+                                tanks_per_team, dps_per_team,
+                                supports_per_team)
+
+    async def _generate_lobbies(self, lobby_count=None, tanks_per_team=None,
+                                dps_per_team=None, supports_per_team=None):
+        if self.queue.is_active == QueueState.ACTIVE:
+            return {}, "Queue must be stopped before generating teams"
+        if self.picking:
+            return {}, "Teams are already being picked"
 
         # Update instance variables if parameters provided
         if tanks_per_team is not None:
@@ -339,20 +664,58 @@ class PickBot:
         if supports_per_team is not None:
             self.supports_per_team = supports_per_team
 
-        team1, team2, captain1, captain2 = self._select_teams(
-            self.tanks_per_team, self.dps_per_team, self.supports_per_team
+        lobbies = await self._select_lobbies(
+            lobby_count or self.lobby_count, self.tanks_per_team,
+            self.dps_per_team, self.supports_per_team
         )
 
-        if not all([team1, team2, captain1, captain2]):
-            return None, None, None, None, "Not enough unique players in each role"
+        if not lobbies:
+            return {}, "Not enough unique players in each role"
+
+        game_ids = self._start_games(lobbies)
+        self.queue.is_active = QueueState.INGAME
+        return ({game_id: teams for game_id, (teams, _)
+                 in zip(game_ids, lobbies)}, "Teams generated successfully")
+
+    def _start_games(self, lobbies):
+        """Create a game for every lobby and keep it in games until it is won
 
+        Args:
+            lobbies (list): (teams, team_ratings) pairs from _select_lobbies
+
+        Returns:
+            list: The new game ids, in lobby order
+        """
+        # Lobbies are created in the same second, so they share the timestamp
+        # id and get the lobby number appended
+        base_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        game_ids = []
+        for number, (teams, team_ratings) in enumerate(lobbies, start=1):
+            game = self._create_game(*teams, team_ratings)
+            game_id = base_id if len(lobbies) == 1 else f'{base_id}-{number}'
+            if isinstance(game, Game):
+                game.game_id = game_id
+            else:
+                game['game_id'] = game_id
+            self.games[game_id] = game
+            game_ids.append(game_id)
+        self.current_game = self.games[game_ids[0]]
+        self.queue.record_pick(game_ids, [
+            player for teams, _ in lobbies for team in teams[:2]
+            for role_players in team.values() for player in role_players],
+            [game_record(self.games[game_id]) for game_id in game_ids])
+        return game_ids
+
+    def _create_game(self, team1, team2, captain1, captain2,
+                     team_ratings=(None, None)):
         # Check if using standard team size (5v5 with 1 tank, 2 dps, 2 support)
         is_standard_size = (
                     self.tanks_per_team == 1 and self.dps_per_team == 2 and self.supports_per_team == 2)
 
         if is_standard_size:
+            team_1_rating, team_2_rating = team_ratings
             # Create the standard Game object that we know how to log
-            self.current_game = Game(
+            game = Game(
                 team_1_tank=team1['tank'][0],
                 team_1_dps1=team1['dps'][0],
                 team_1_dps2=team1['dps'][1],
@@ -366,31 +729,64 @@ class PickBot:
                 team_1_captain=captain1,
                 team_2_captain=captain2
             )
+            if team_1_rating is not None:
+                game.team_1_avg_sr = round(team_1_rating)
+                game.team_2_avg_sr = round(team_2_rating)
+            return game
+
+        # For non-standard teams, create a placeholder object that won't be logged
+        print("Non-standard team size detected - logging will be disabled")
+        return {"team1": team1, "team2": team2, "nonstandard": True}
+
+    def _write_game(self, game):
+        rate_game(game)
+        for sink in self.history_sinks:
+            game.log_game(sink)
+
+    def _log_game(self, game):
+        """Write a finished game on the database thread without waiting for it."""
+        future = submit_db(self._write_game, game)
+        future.add_done_callback(self._report_log_error)
+        return future
+
+    @staticmethod
+    def _report_log_error(future):
+        if future.exception() is not None:
+            print(f"Failed to log game: {future.exception()}")
+
+    def record_winner(self, game_id, winner):
+        """Record the winning team ('team1' or 'team2') of a running game.
+
+        The queue goes back to inactive once every running game is won.
+        """
+        self.run_command(self._record_winner, game_id, winner)
+
+    def _record_winner(self, game_id, winner):
+        if game_id is None:
+            # The oldest running game
+            game_id = next(iter(self.games), None)
+        game = self.games.pop(game_id, None)
+        if game is not None:
+            self.queue.record_winner(game_id, winner)
+        if isinstance(game, Game):
+            game.winner = winner
+            self._log_game(game)
         else:
-            # For non-standard teams, create a placeholder object that won't be logged
-            print("Non-standard team size detected - logging will be disabled")
-            self.current_game = {"team1": team1, "team2": team2,
-                                 "nonstandard": True}
-
-        return team1, team2, captain1, captain2, "Teams generated successfully"
+            print("Non-standard team size - game not logged")
+        self.current_game = next(iter(self.games.values()), None)
+        if not self.games:
+            self.queue.is_active = QueueState.INACTIVE
 
     def winner1(self):
-        if isinstance(self.current_game, Game):
-            self.current_game.winner='team1'
-            self.current_game.log_game('archive/games.csv')
-        else:
-            print("Non-standard team size - game not logged")
-        self.queue.is_active = 'inactive'
-        self.current_game = None
+        self.record_winner(None, 'team1')
 
     def winner2(self):
-        if isinstance(self.current_game, Game):
-            self.current_game.winner='team2'
-            self.current_game.log_game('archive/games.csv')
-        else:
-            print("Non-standard team size - game not logged")
-        self.queue.is_active = 'inactive'
-        self.current_game = None
+        self.record_winner(None, 'team2')
+
+    def running_games(self):
+        """Ids of the games waiting for a winner, oldest first, as of the
+        last published snapshot"""
+        return list(self.queue.snapshot.games)
 
     def populate_full_queue(self, num_players=20):
         """
@@ -399,23 +795,19 @@ class PickBot:
         Args:
             num_players (int): Number of players to add to each role
         """
-        # Clear the queue first
-        self.queue.tank.clear()
-        self.queue.dps.clear()
-        self.queue.support.clear()
+        return self.run_command(self._populate_full_queue, num_players)
 
-        # Activate the queue to allow adding users
-        old_state = self.queue.is_active
-        self.queue.is_active = 'active'
+    def _populate_full_queue(self, num_players):
+        # Clear the queue first
+        self.queue.clear()
 
         # Add test users to each role
-        for i in range(1, num_players + 1):
-            self.queue.tank.add(f"test_tank{i}")
-            self.queue.dps.add(f"test_dps{i}")
-            self.queue.support.add(f"test_support{i}")
+        self.queue.add('tank', (f"test_tank{i}" for i in range(1, num_players + 1)))
+        self.queue.add('dps', (f"test_dps{i}" for i in range(1, num_players + 1)))
+        self.queue.add('support', (f"test_support{i}" for i in range(1, num_players + 1)))
 
         # Return the queue to inactive state for team generation
-        self.queue.is_active = 'inactive'
+        self.queue.is_active = QueueState.INACTIVE
 
         print(f"\nAdded {num_players} test players to each role")
         return f"Populated queue with {num_players} players in each role. Queue now has {len(self.queue.tank)} tanks, {len(self.queue.dps)} DPS, and {len(self.queue.support)} supports."
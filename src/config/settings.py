@@ -19,6 +19,14 @@ else:
     config['Database'] = {
         'path': 'archive/database.db'
     }
+    config['History'] = {
+        'format': 'csv, sqlite',
+        'csv_path': 'archive/games.csv',
+        'parquet_dir': 'archive/games'
+    }
+    config['Journal'] = {
+        'path': 'archive/queue_journal.jsonl'
+    }
 
 
 TWITCH_CHANNEL = config.get('Twitch', 'channel')
@@ -28,3 +36,20 @@ TWITCH_WEBSOCKET_URI = 'wss://irc-ws.chat.twitch.tv:443'
 DB_FILE = config.get('Database', 'path', fallback='archive/database.db')
 
 BOT_ADMINS = {admin.strip() for admin in config.get('Bot', 'admins').split(',')}
+
+# Comma separated list of csv, parquet and sqlite ('both' means csv, parquet)
+HISTORY_FORMAT = config.get('History', 'format', fallback='csv, sqlite').strip().lower()
+HISTORY_CSV_PATH = config.get('History', 'csv_path', fallback='archive/games.csv')
+HISTORY_PARQUET_DIR = config.get('History', 'parquet_dir', fallback='archive/games')
+
+# Queue journal for crash recovery, an empty path turns it off
+QUEUE_JOURNAL_PATH = config.get('Journal', 'path', fallback='archive/queue_journal.jsonl').strip()
+
+# Chat messages waiting for the handlers, and what to drop when that is full
+# (drop_oldest or drop_newest, duplicate joins always go first)
+INGEST_BUFFER_SIZE = config.getint('Ingest', 'buffer_size', fallback=10000)
+INGEST_OVERFLOW = config.get('Ingest', 'overflow', fallback='drop_oldest').strip().lower()
+# Chat lines per second each viewer may send (0 turns the limit off), and
+# how many they may send at once
+CHAT_USER_RATE = config.getfloat('Ingest', 'user_rate', fallback=1.0)
+CHAT_USER_BURST = config.getint('Ingest', 'user_burst', fallback=5)
@@ -2,6 +2,11 @@ import streamlit as st
 import asyncio
 import threading
 from src.bot.twitch_bot import PickBot
+from src.bot.queue import QueueState
+
+# Seconds between checks of the bot's change feed for the live queue panel
+LIVE_REFRESH_SECONDS = 1
+ROLES = ('tank', 'dps', 'support')
 
 
 # Fix for the team composition selection in streamlit_gui.py
@@ -16,10 +21,158 @@ def init_session_state():
         st.session_state.dps_per_team = 2
     if 'supports_per_team' not in st.session_state:
         st.session_state.supports_per_team = 2
+    if 'lobby_count' not in st.session_state:
+        st.session_state.lobby_count = 1
+
+
+@st.cache_resource
+def get_bot():
+    """The bot of this GUI process, shared by every browser session.
+
+    It owns the chat connection and the queue journal, so there is only one
+    however many sessions are open.
+    """
+    bot = PickBot()
+
+    # Start bot in background
+    def run_bot(bot):
+        asyncio.run(bot.connect_and_run())
+
+    thread = threading.Thread(target=run_bot, args=(bot,))
+    thread.daemon = True
+    thread.start()
+    return bot
+
+
+def sync_queue_view(bot):
+    """Bring this session's copy of the queue up to date.
+
+    Only the change events since the last sync are applied. A full copy of
+    the snapshot is taken on the first call, or when the session fell so
+    far behind that the feed no longer has the events it missed.
+
+    Returns:
+        tuple: (view, events), events is None after a full copy
+    """
+    view = st.session_state.get('queue_view')
+    events = None if view is None else bot.queue.changes.since(view['version'])
+    if events is None:
+        snapshot = bot.queue.snapshot
+        view = {'version': snapshot.version, 'is_active': snapshot.is_active}
+        for role in ROLES:
+            view[role] = set(getattr(snapshot, role))
+        st.session_state.queue_view = view
+        return view, None
+
+    for event in events:
+        if event.kind == 'join':
+            for role in event.data['roles']:
+                view[role].add(event.data['username'])
+        elif event.kind == 'add':
+            view[event.data['role']].update(event.data['usernames'])
+        elif event.kind == 'clear':
+            for role in ROLES:
+                view[role].clear()
+        elif event.kind == 'state':
+            view['is_active'] = event.data['state']
+        view['version'] = event.version
+    return view, events
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def connection_status(bot):
+    """Connection state and health counters of the bot's chat connection"""
+    stats = bot.connection.stats
+    if stats.connected:
+        st.success("Connected to Twitch")
+    elif stats.connects:
+        st.error(f"Not connected to Twitch, reconnecting "
+                 f"(down for {stats.current_outage():.0f}s)")
+    else:
+        st.error("Not connected to Twitch")
+
+    with st.expander("Connection Health"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Ping",
+                      "-" if stats.last_rtt is None
+                      else f"{stats.last_rtt * 1000:.0f} ms")
+        with col2:
+            st.metric("Reconnects", stats.reconnects)
+        with col3:
+            st.metric("Downtime",
+                      f"{stats.downtime + stats.current_outage():.0f}s")
+        with col4:
+            st.metric("Frames Received", stats.frames_received)
+
+        ingest = bot.ingest.stats
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Chat Backlog", ingest.depth)
+        with col2:
+            st.metric("Peak Backlog", ingest.peak_depth)
+        with col3:
+            st.metric("Handled", ingest.handled)
+        with col4:
+            st.metric("Dropped",
+                      ingest.dropped_duplicates + ingest.dropped_overflow)
+
+        filtered = bot.chat_filter.stats
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Lines Accepted", filtered.accepted)
+        with col2:
+            st.metric("Repeated Joins", filtered.duplicates)
+        with col3:
+            st.metric("Rate Limited", filtered.rate_limited)
+        if stats.last_error:
+            st.caption(f"Last error: {stats.last_error}")
+
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_queue_status(bot):
+    """Queue counts and players, redrawn on their own as the queue changes"""
+    view, events = sync_queue_view(bot)
+    # State changes and picks from chat affect the rest of the page as well.
+    # During a full page run the page is being redrawn anyway.
+    if (events and not st.session_state.get('rendering_page')
+            and any(event.kind in ('state', 'pick', 'winner')
+                    for event in events)):
+        st.rerun()
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Tank", len(view['tank']))
+    with col2:
+        st.metric("DPS", len(view['dps']))
+    with col3:
+        st.metric("Support", len(view['support']))
+
+    with st.expander("Show Queued Players"):
+        columns = st.columns(3)
+        for column, role, title in zip(columns, ROLES,
+                                       ("Tank", "DPS", "Support")):
+            with column:
+                st.subheader(title)
+                for player in sorted(view[role]):
+                    st.write(player)
+
+
+def show_team(title, team, captain):
+    st.subheader(title)
+    for role, label in (('tank', 'Tank'), ('dps', 'DPS'),
+                        ('support', 'Support')):
+        if role in team:
+            players = team[role]
+            if isinstance(players, list):
+                st.write(f"{label}: {', '.join(players)}")
+            else:
+                st.write(f"{label}: {players}")
+    st.write(f"**Captain**: {captain}")
 
 
 # Modify the main function's team composition section:
-def main():
+def render_page():
     st.title("PUG Picker")
     print("Started!")
 
@@ -28,32 +181,20 @@ def main():
 
     # Initialize bot if needed
     if 'bot_initialized' not in st.session_state:
-        st.session_state.bot = PickBot()
+        bot = get_bot()
+        st.session_state.bot = bot
         st.session_state.bot_initialized = True
 
-        # Set the bot's initial team composition from session state
-        st.session_state.bot.tanks_per_team = st.session_state.tanks_per_team
-        st.session_state.bot.dps_per_team = st.session_state.dps_per_team
-        st.session_state.bot.supports_per_team = st.session_state.supports_per_team
-
-        # Start bot in background
-        def run_bot(bot):
-            asyncio.run(bot.connect_and_run())
-
-        thread = threading.Thread(target=run_bot, args=(st.session_state.bot,))
-        thread.daemon = True
-        thread.start()
+        # Show the team composition the shared bot already uses
+        st.session_state.tanks_per_team = bot.tanks_per_team
+        st.session_state.dps_per_team = bot.dps_per_team
+        st.session_state.supports_per_team = bot.supports_per_team
+        st.session_state.lobby_count = bot.lobby_count
 
     # Get the bot instance
     bot = st.session_state.bot
 
-    # Connection status
-    is_connected = bot.websocket is not None and hasattr(bot.websocket,
-                                                         'open') and bot.websocket.open
-    if is_connected:
-        st.success("Connected to Twitch")
-    else:
-        st.error("Not connected to Twitch")
+    connection_status(bot)
 
     # Team Composition Config section
     st.header("Team Composition")
@@ -61,15 +202,16 @@ def main():
     # Create update functions for each input
     def update_tanks():
         st.session_state.tanks_per_team = st.session_state.tanks_input
-        bot.tanks_per_team = st.session_state.tanks_per_team
+        bot.set_composition(tanks_per_team=st.session_state.tanks_per_team)
 
     def update_dps():
         st.session_state.dps_per_team = st.session_state.dps_input
-        bot.dps_per_team = st.session_state.dps_per_team
+        bot.set_composition(dps_per_team=st.session_state.dps_per_team)
 
     def update_supports():
         st.session_state.supports_per_team = st.session_state.supports_input
-        bot.supports_per_team = st.session_state.supports_per_team
+        bot.set_composition(
+            supports_per_team=st.session_state.supports_per_team)
 
     # Display the inputs with their corresponding update functions
     col1, col2, col3 = st.columns(3)
@@ -101,9 +243,25 @@ def main():
             on_change=update_supports
         )
 
+    def update_lobbies():
+        st.session_state.lobby_count = st.session_state.lobbies_input
+        bot.set_composition(lobby_count=st.session_state.lobby_count)
+
+    st.number_input(
+        "Simultaneous lobbies",
+        min_value=1,
+        max_value=20,
+        value=st.session_state.lobby_count,
+        key="lobbies_input",
+        on_change=update_lobbies
+    )
+
     # Calculate total players per team
     total = st.session_state.tanks_per_team + st.session_state.dps_per_team + st.session_state.supports_per_team
     st.info(f"Total players per team: {total} (Teams of {total}v{total})")
+    if st.session_state.lobby_count > 1:
+        st.info(f"{st.session_state.lobby_count} lobbies need "
+                f"{2 * total * st.session_state.lobby_count} players")
 
     # Warning for non-standard teams
     is_standard = (st.session_state.tanks_per_team == 1 and
@@ -122,23 +280,22 @@ def main():
             st.info(status)
     with col2:
         if st.button('Reenable Queue without clearing'):
-            bot.queue.is_active = 'active'
+            bot.resume_queue()
 
-    # Queue status with refresh button side by side
-    col1, col2, col3 = st.columns([3, 1, 2])  # 3:1 ratio for status vs button
+    # Queue status with the player check side by side
+    col1, col2 = st.columns([4, 2])
     with col1:
         st.header("Queue Status")
     with col2:
-        st.button("Refresh Queue", key="refresh_queue")
-    with col3:
         if st.button('Enough Players?'):
-            all_players = bot.queue.support | bot.queue.tank | bot.queue.dps
-            valid_players = all_players
-            if len(valid_players) < 10:
-                st.write(f'There is not enough players, only '
-                         f'{len(valid_players)} valid players.')
-            if len(valid_players) >= 10:
-                st.write('Yeah! YIPPIE')
+            # Exact for the configured composition and lobby count
+            snapshot = bot.queue.snapshot
+            lobby_count = st.session_state.lobby_count
+            status = bot.fill_status(snapshot, lobby_count)
+            if snapshot.can_fill(bot.slots_needed(lobby_count)):
+                st.write(f'Yeah! YIPPIE. {status}')
+            else:
+                st.write(status)
     # Add this after the Queue Status section in streamlit_gui.py
 
     # Testing Tools Section
@@ -152,122 +309,62 @@ def main():
         import os
         os.makedirs("archive", exist_ok=True)
         st.success("Archive directory created (if it didn't exist)")
-    # Status metrics
-    col1, col2, col3 = st.columns(3)
-    status = bot.get_queue_status()
-    with col1:
-        st.metric("Tank", status['tank_count'])
-    with col2:
-        st.metric("DPS", status['dps_count'])
-    with col3:
-        st.metric("Support", status['support_count'])
-
-    # After queue status, maybe add expandable player lists
-    with st.expander("Show Queued Players"):
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.subheader("Tank")
-            for player in status['tank_players']:
-                st.write(player)
-        with col2:
-            st.subheader("DPS")
-            for player in status['dps_players']:
-                st.write(player)
-        with col3:
-            st.subheader("Support")
-            for player in status['support_players']:
-                st.write(player)
+    # Counts and player lists follow the queue live
+    live_queue_status(bot)
 
     st.header('Team selection')
-    if bot.queue.is_active == 'active':
+    # Immutable copy of the queue, the bot thread keeps changing the live one
+    queue_state = bot.queue.snapshot.is_active
+    if queue_state == QueueState.ACTIVE:
         st.write('Queue must be stopped before generating teams!')
-    if bot.queue.is_active == 'ingame':
+    if queue_state == QueueState.INGAME:
         st.write('Game must be completed before generating teams!')
     else:
-        # Replace the team display section in streamlit_gui.py with this updated code
-
         if st.button('Generate Teams'):
-            team1, team2, captain1, captain2, message = bot.generate_teams()
-            if team1 and team2:
+            games, message = bot.generate_lobbies(st.session_state.lobby_count)
+            if games:
                 st.success('Generated Teams!')
-                bot.queue.is_active = 'ingame'
-                col1, col2 = st.columns(2)
-
-                with col1:
-                    st.subheader('Team Blue')
-
-                    # Display tanks
-                    if 'tank' in team1:
-                        tanks = team1['tank']
-                        if isinstance(tanks, list):
-                            st.write(f"Tank: {', '.join(tanks)}")
-                        else:
-                            st.write(f"Tank: {tanks}")
-
-                    # Display DPS
-                    if 'dps' in team1:
-                        dps = team1['dps']
-                        if isinstance(dps, list):
-                            st.write(f"DPS: {', '.join(dps)}")
-                        else:
-                            st.write(f"DPS: {dps}")
-
-                    # Display support
-                    if 'support' in team1:
-                        support = team1['support']
-                        if isinstance(support, list):
-                            st.write(f"Support: {', '.join(support)}")
-                        else:
-                            st.write(f"Support: {support}")
-
-                    st.write(f"**Captain**: {captain1}")
-
-                with col2:
-                    st.subheader('Team Red')
-
-                    # Display tanks
-                    if 'tank' in team2:
-                        tanks = team2['tank']
-                        if isinstance(tanks, list):
-                            st.write(f"Tank: {', '.join(tanks)}")
-                        else:
-                            st.write(f"Tank: {tanks}")
-
-                    # Display DPS
-                    if 'dps' in team2:
-                        dps = team2['dps']
-                        if isinstance(dps, list):
-                            st.write(f"DPS: {', '.join(dps)}")
-                        else:
-                            st.write(f"DPS: {dps}")
-
-                    # Display support
-                    if 'support' in team2:
-                        support = team2['support']
-                        if isinstance(support, list):
-                            st.write(f"Support: {', '.join(support)}")
-                        else:
-                            st.write(f"Support: {support}")
-
-                    st.write(f"**Captain**: {captain2}")
+                for game_id, (team1, team2, captain1, captain2) in games.items():
+                    if len(games) > 1:
+                        st.subheader(f'Game {game_id}')
+                    col1, col2 = st.columns(2)
+
+                    with col1:
+                        show_team('Team Blue', team1, captain1)
+
+                    with col2:
+                        show_team('Team Red', team2, captain2)
             else:
                 st.error('Not enough unique players in the queue')
 
     st.header('Game management:')
-    if bot.queue.is_active == 'ingame':
-        st.subheader('Winner:')
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button('Team Red'):
-                bot.winner1()
-                bot.queue.is_active = 'inactive'
-        with col2:
-            if st.button('Team Blue'):
-                bot.winner2()
-                bot.queue.is_active = 'inactive'
+    running_games = bot.running_games()
+    if bot.queue.snapshot.is_active == QueueState.INGAME and running_games:
+        for game_id in running_games:
+            st.subheader(f'Winner of game {game_id}:'
+                         if len(running_games) > 1 else 'Winner:')
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button('Team Red', key=f'team1_{game_id}'):
+                    bot.record_winner(game_id, 'team1')
+            with col2:
+                if st.button('Team Blue', key=f'team2_{game_id}'):
+                    bot.record_winner(game_id, 'team2')
 
     else:
         st.subheader('No game active!')
+
+
+def main():
+    # Read by the live fragments, also reset when the run ends early
+    # through an exception, st.stop() or st.rerun()
+    st.session_state.rendering_page = True
+    try:
+        render_page()
+    finally:
+        st.session_state.rendering_page = False
+
+
 if __name__ == "__main__":
     import sys
     import streamlit.web.bootstrap
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.bot import database
+
+
+@pytest.fixture
+def temporary_database(tmp_path, monkeypatch):
+    """Point the bot's database helpers at a throwaway SQLite file"""
+    monkeypatch.setattr(database, 'DB_FILE', str(tmp_path / 'test.db'))
+    yield database.DB_FILE
+    # Let queued writes finish before the file disappears
+    database.submit_db(lambda: None).result()
+    database.close_all_pools()
+
+
+@pytest.fixture
+def make_bot(temporary_database, tmp_path, monkeypatch):
+    """Build PickBots, each with a database of its own and no game history"""
+    from src.bot import twitch_bot
+
+    monkeypatch.setattr(twitch_bot, 'create_history_sinks', lambda: [])
+    bots = []
+
+    def make(seed=None):
+        if bots:
+            database.submit_db(lambda: None).result()
+            database.close_all_pools()
+            monkeypatch.setattr(database, 'DB_FILE',
+                                str(tmp_path / f'test{len(bots)}.db'))
+        bot = twitch_bot.PickBot(seed=seed, journal_path=None)
+        bots.append(bot)
+        return bot
+
+    yield make
+    for bot in bots:
+        bot.priorities.stop()
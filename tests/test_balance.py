@@ -0,0 +1,89 @@
+import itertools
+import random
+
+import pytest
+
+from src.bot import balance
+from src.bot.balance import balance_teams
+
+PER_TEAM = {'tank': 1, 'dps': 2, 'support': 2}
+
+
+def random_pick(rng, per_team):
+    selected = {role: [f'{role}{i}' for i in range(2 * count)]
+                for role, count in per_team.items()}
+    ratings = {player: rng.randint(800, 2200)
+               for players in selected.values() for player in players}
+    return selected, ratings
+
+
+def smallest_difference(selected, per_team, ratings):
+    """Reference answer from every split, the way the docstring describes it"""
+    total = sum(ratings[player] for players in selected.values()
+                for player in players)
+    team_size = sum(per_team.values())
+    best = None
+    for choice in itertools.product(*(
+            itertools.combinations(selected[role], per_team[role])
+            for role in selected)):
+        team_1_sum = sum(ratings[player] for chosen in choice
+                         for player in chosen)
+        difference = abs(2 * team_1_sum - total) / team_size
+        best = difference if best is None else min(best, difference)
+    return best
+
+
+def check_split(selected, per_team, ratings, result):
+    team_1, team_2, team_1_average, team_2_average = result
+    team_size = sum(per_team.values())
+    for role, players in selected.items():
+        assert len(team_1[role]) == len(team_2[role]) == per_team[role]
+        assert sorted(team_1[role] + team_2[role]) == sorted(players)
+    for team, average in ((team_1, team_1_average), (team_2, team_2_average)):
+        rating_sum = sum(ratings[player] for players in team.values()
+                         for player in players)
+        assert average == pytest.approx(rating_sum / team_size)
+    return abs(team_1_average - team_2_average)
+
+
+def test_equal_ratings_keep_the_first_half_on_team_1():
+    selected = {'tank': ['t1', 't2'], 'dps': ['d1', 'd2', 'd3', 'd4'],
+                'support': ['s1', 's2', 's3', 's4']}
+    ratings = dict.fromkeys(itertools.chain(*selected.values()), 1500)
+    team_1, team_2, team_1_average, team_2_average = balance_teams(
+        selected, PER_TEAM, ratings)
+    assert team_1 == {'tank': ['t1'], 'dps': ['d1', 'd2'],
+                      'support': ['s1', 's2']}
+    assert team_2 == {'tank': ['t2'], 'dps': ['d3', 'd4'],
+                      'support': ['s3', 's4']}
+    assert team_1_average == team_2_average == 1500
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_brute_force_finds_the_most_even_split(seed):
+    selected, ratings = random_pick(random.Random(seed), PER_TEAM)
+    difference = check_split(selected, PER_TEAM, ratings,
+                             balance_teams(selected, PER_TEAM, ratings))
+    assert difference == pytest.approx(
+        smallest_difference(selected, PER_TEAM, ratings))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_meet_in_the_middle_matches_brute_force(seed, monkeypatch):
+    per_team = {'tank': 2, 'dps': 3, 'support': 2}
+    selected, ratings = random_pick(random.Random(seed), per_team)
+    monkeypatch.setattr(balance, 'BRUTE_FORCE_LIMIT', 0)
+    difference = check_split(selected, per_team, ratings,
+                             balance_teams(selected, per_team, ratings))
+    assert difference == pytest.approx(
+        smallest_difference(selected, per_team, ratings))
+
+
+def test_roles_without_players_stay_empty():
+    per_team = {'tank': 0, 'dps': 1, 'support': 1}
+    selected = {'tank': [], 'dps': ['d1', 'd2'], 'support': ['s1', 's2']}
+    ratings = {'d1': 2000, 'd2': 1000, 's1': 2000, 's2': 1000}
+    team_1, team_2, team_1_average, team_2_average = balance_teams(
+        selected, per_team, ratings)
+    assert team_1['tank'] == team_2['tank'] == []
+    assert team_1_average == team_2_average == 1500
@@ -0,0 +1,74 @@
+from src.bot.chat_filter import ChatFilter
+from src.bot.queue import ROLE_KEYWORDS
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def privmsg(nickname, text, message_id=1):
+    return (f'@id={message_id};color=#FF0000 :{nickname}!{nickname}'
+            f'@{nickname}.tmi.twitch.tv PRIVMSG #channel :{text}')
+
+
+def make_filter(rate=1.0, burst=2, **kwargs):
+    clock = Clock()
+    return ChatFilter(rate, burst, keywords=ROLE_KEYWORDS, clock=clock,
+                      **kwargs), clock
+
+
+def test_repeated_join_in_the_same_epoch_is_dropped():
+    chat_filter, _ = make_filter(rate=0)
+    line = chat_filter.admit(privmsg('viewer', 'tank', 1), epoch=0)
+    assert line.startswith(':viewer!')
+    chat_filter.remember_join('viewer', line, epoch=0)
+
+    # Same text with different tags is the same join
+    assert chat_filter.admit(privmsg('viewer', 'tank', 2), epoch=0) is None
+    assert chat_filter.admit(privmsg('viewer', 'tank', 3), epoch=1) is not None
+    assert chat_filter.admit(privmsg('viewer', 'dps', 4), epoch=0) is not None
+    assert chat_filter.stats.duplicates == 1
+
+
+def test_forget_lets_the_next_join_through():
+    chat_filter, _ = make_filter(rate=0)
+    line = chat_filter.admit(privmsg('viewer', 'tank'), epoch=0)
+    chat_filter.remember_join('viewer', line, epoch=0)
+    chat_filter.forget('viewer')
+    assert chat_filter.admit(privmsg('viewer', 'tank'), epoch=0) is not None
+
+
+def test_rate_limit_refills_over_time():
+    chat_filter, clock = make_filter(rate=1.0, burst=2)
+    results = [chat_filter.admit(privmsg('viewer', keyword), epoch=0)
+               for keyword in ('tank', 'dps', 'support')]
+    assert [line is not None for line in results] == [True, True, False]
+    assert chat_filter.stats.rate_limited == 1
+
+    clock.now += 1.0
+    assert chat_filter.admit(privmsg('viewer', 'flex'), epoch=0) is not None
+    assert chat_filter.admit(privmsg('viewer', 'tank'), epoch=0) is None
+
+
+def test_ordinary_chat_does_not_use_up_tokens():
+    chat_filter, _ = make_filter(rate=1.0, burst=1)
+    for _ in range(10):
+        assert chat_filter.admit(privmsg('viewer', 'hello chat'), epoch=0)
+    assert chat_filter.admit(privmsg('viewer', ' Tank '), epoch=0) is not None
+    assert chat_filter.stats.rate_limited == 0
+
+
+def test_exempt_users_are_never_limited():
+    chat_filter, _ = make_filter(rate=1.0, burst=1, exempt={'admin'})
+    for keyword in ('tank', 'dps', 'support', 'flex'):
+        assert chat_filter.admit(privmsg('admin', keyword), epoch=0)
+
+
+def test_other_lines_pass_untouched():
+    chat_filter, _ = make_filter()
+    assert chat_filter.admit('PING :tmi.twitch.tv', epoch=0) == \
+        'PING :tmi.twitch.tv'
@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+
+from src.analysis.history_loader import HistoryLoader
+
+HEADER = 'game_id,timestamp,player\n'
+
+
+def row(game, player):
+    return f'{game:04d},20260101-12{game:02d}00,{player}\n'
+
+
+def test_csv_is_parsed_incrementally_as_it_grows(tmp_path):
+    path = tmp_path / 'games.csv'
+    path.write_text(HEADER + row(1, 'a') + row(1, 'b'))
+    loader = HistoryLoader()
+    first = loader.load(str(path))
+    assert list(first['player']) == ['a', 'b']
+    assert loader.load(str(path)) is first
+
+    # The half-written last line is left for the next load
+    with open(path, 'a') as f:
+        f.write(row(2, 'c') + '0002,20260101-1202')
+    grown = loader.load(str(path))
+    assert list(grown['player']) == ['a', 'b', 'c']
+    assert grown['game_id'].tolist() == ['0001', '0001', '0002']
+
+    with open(path, 'a') as f:
+        f.write('00,d\n')
+    assert list(loader.load(str(path))['player']) == ['a', 'b', 'c', 'd']
+    assert loader.load(str(path))['timestamp'].iloc[-1] == pd.Timestamp(
+        '2026-01-01 12:02:00')
+
+
+def test_replaced_csv_is_reloaded(tmp_path):
+    path = tmp_path / 'games.csv'
+    path.write_text(HEADER + row(1, 'a') + row(1, 'b'))
+    loader = HistoryLoader()
+    loader.load(str(path))
+
+    replacement = tmp_path / 'games.csv.tmp'
+    replacement.write_text(HEADER + row(3, 'x') + row(3, 'y') + row(3, 'z'))
+    os.replace(replacement, path)
+    assert list(loader.load(str(path))['player']) == ['x', 'y', 'z']
+
+
+def write_part(directory, name, game, players):
+    frame = pd.DataFrame({'game_id': [f'{game:04d}'] * len(players),
+                          'timestamp': [f'20260101-12{game:02d}00'] * len(players),
+                          'player': players})
+    frame.to_parquet(directory / name)
+    return frame
+
+
+def test_parquet_parts_are_replaced_by_the_compacted_session(tmp_path):
+    loader = HistoryLoader()
+    write_part(tmp_path, 'session-a-part0000.parquet', 1, ['a', 'b'])
+    assert list(loader.load(str(tmp_path))['player']) == ['a', 'b']
+
+    write_part(tmp_path, 'session-a-part0001.parquet', 2, ['c'])
+    frame = loader.load(str(tmp_path))
+    assert list(frame['player']) == ['a', 'b', 'c']
+    assert loader.load(str(tmp_path)) is frame
+
+    # Compaction writes the session file before it removes the parts, a
+    # load in between must not count the games twice
+    write_part(tmp_path, 'session-a.parquet', 1, ['a', 'b', 'c'])
+    assert list(loader.load(str(tmp_path))['player']) == ['a', 'b', 'c']
+    for part in tmp_path.glob('session-a-part*.parquet'):
+        part.unlink()
+    write_part(tmp_path, 'session-b-part0000.parquet', 3, ['d'])
+    assert list(loader.load(str(tmp_path))['player']) == ['a', 'b', 'c', 'd']
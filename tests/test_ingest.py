@@ -0,0 +1,61 @@
+import pytest
+
+from src.bot.ingest import IngestBuffer
+
+
+def drain(buffer):
+    messages = []
+    while (message := buffer.pop()) is not None:
+        messages.append((message.username, message.content))
+    return messages
+
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        IngestBuffer(overflow='drop_everything')
+
+
+def test_drop_oldest_evicts_the_oldest_join():
+    dropped = []
+    buffer = IngestBuffer(2, 'drop_oldest', on_drop=dropped.append)
+    for username in ('a', 'b', 'c'):
+        assert buffer.put(username, 'tank')
+    assert [message.username for message in dropped] == ['a']
+    assert drain(buffer) == [('b', 'tank'), ('c', 'tank')]
+    assert buffer.stats.dropped_overflow == 1
+
+
+def test_drop_newest_keeps_the_waiting_joins():
+    buffer = IngestBuffer(2, 'drop_newest')
+    assert buffer.put('a', 'tank')
+    assert buffer.put('b', 'tank')
+    assert not buffer.put('c', 'tank')
+    assert drain(buffer) == [('a', 'tank'), ('b', 'tank')]
+    assert buffer.stats.dropped_overflow == 1
+
+
+def test_duplicate_joins_go_first():
+    buffer = IngestBuffer(3, 'drop_newest')
+    buffer.put('a', 'tank')
+    buffer.put('b', 'dps')
+    buffer.put('a', 'tank')
+    # Full: the incoming repeat of a waiting join is dropped...
+    assert not buffer.put('b', 'dps')
+    # ...and a new join evicts the waiting repeat instead of being dropped
+    assert buffer.put('c', 'support')
+    assert drain(buffer) == [('a', 'tank'), ('b', 'dps'), ('c', 'support')]
+    assert buffer.stats.dropped_duplicates == 2
+    assert buffer.stats.dropped_overflow == 0
+
+
+def test_admin_commands_are_never_dropped():
+    buffer = IngestBuffer(1, 'drop_newest')
+    buffer.put('a', 'tank')
+    assert buffer.put('admin', '!start', admin=True)
+    assert buffer.put('admin', '!stop', admin=True)
+    assert len(buffer) == 3
+    # Evicting for a join never touches the commands
+    buffer = IngestBuffer(1, 'drop_oldest')
+    buffer.put('admin', '!start', admin=True)
+    buffer.put('a', 'tank')
+    assert drain(buffer) == [('admin', '!start'), ('a', 'tank')]
@@ -0,0 +1,46 @@
+from src.bot.irc import parse_line
+
+
+def test_privmsg_with_tags_prefix_and_trailing():
+    message = parse_line(
+        '@badge-info=;display-name=Some\\sName;id=abc :viewer!viewer@viewer.tmi.twitch.tv '
+        'PRIVMSG #channel :!join tank dps')
+    assert message.command == 'PRIVMSG'
+    assert message.params == ['#channel', '!join tank dps']
+    assert message.nick == 'viewer'
+    assert message.trailing == '!join tank dps'
+    assert message.tags == {'badge-info': '', 'display-name': 'Some Name',
+                            'id': 'abc'}
+
+
+def test_tag_escapes_are_unescaped():
+    message = parse_line('@msg=a\\:b\\\\c\\nd :tmi.twitch.tv NOTICE * :x')
+    assert message.tags['msg'] == 'a;b\\c\nd'
+
+
+def test_server_messages_have_no_nick():
+    message = parse_line('PING :tmi.twitch.tv')
+    assert message.command == 'PING'
+    assert message.prefix is None
+    assert message.nick is None
+    assert message.trailing == 'tmi.twitch.tv'
+
+    message = parse_line(':tmi.twitch.tv 001 commanderx :Welcome, GLHF!')
+    assert message.command == '001'
+    assert message.nick is None
+    assert message.params == ['commanderx', 'Welcome, GLHF!']
+
+
+def test_trailing_keeps_colons_and_spaces():
+    message = parse_line(':a!a@a PRIVMSG #channel ::)  spaced  out ')
+    assert message.trailing == ':)  spaced  out '
+
+
+def test_command_is_upper_cased():
+    assert parse_line('ping :x').command == 'PING'
+
+
+def test_empty_lines_parse_to_none():
+    assert parse_line('') is None
+    assert parse_line(':prefix.only') is None
+    assert parse_line('@tag=1 :prefix.only ') is None
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from src.bot.journal import QueueJournal, empty_state
+from src.bot.queue import DPS, SUPPORT, TANK, Queue, QueueState
+
+
+def recover(path, **kwargs):
+    """Recover a journal and release it again"""
+    journal = QueueJournal(str(path), **kwargs)
+    state = journal.recover()
+    journal.stop()
+    return state
+
+
+def run(path, changes, state=None, **kwargs):
+    """Recover, apply changes to a queue that continues from it, and stop"""
+    journal = QueueJournal(str(path), **kwargs)
+    state = journal.recover()
+    queue = Queue()
+    queue.restore(state['version'], state['is_active'], state['players'])
+    journal.start(queue, lambda: pytest.fail("the journal fell behind"))
+    changes(queue)
+    queue.publish()
+    journal.stop()
+    return queue
+
+
+def test_nothing_saved_recovers_an_empty_state(tmp_path):
+    assert recover(tmp_path / 'queue.jsonl') == empty_state()
+
+
+def test_snapshot_plus_replay_restores_the_queue(tmp_path):
+    path = tmp_path / 'queue.jsonl'
+
+    def changes(queue):
+        queue.is_active = QueueState.ACTIVE
+        for i in range(6):
+            queue.join(f'p{i}', TANK if i % 2 else DPS | SUPPORT)
+            queue.publish()
+        queue.add('tank', ['p0'])
+
+    queue = run(path, changes, snapshot_every=3)
+    with open(tmp_path / 'queue.snapshot.json') as f:
+        snapshot_version = json.load(f)['version']
+    # Only what came after the last snapshot is left to replay
+    assert len(path.read_text().splitlines()) == 8 - snapshot_version < 3
+
+    state = recover(path, snapshot_every=3)
+    assert state['version'] == queue.version == 8
+    assert state['is_active'] == 'active'
+    assert state['players'] == queue.player_masks()
+    assert list(state['players']) == [f'p{i}' for i in range(6)]
+
+
+def test_lines_the_snapshot_has_are_not_applied_twice(tmp_path):
+    path = tmp_path / 'queue.jsonl'
+    snapshot = empty_state()
+    snapshot.update(version=2, players={'a': TANK})
+    (tmp_path / 'queue.snapshot.json').write_text(json.dumps(snapshot))
+    # A crash between the snapshot and the journal truncation
+    events = [(1, 'clear', {}),
+              (2, 'join', {'username': 'a', 'roles': ['tank']}),
+              (3, 'join', {'username': 'b', 'roles': ['dps', 'support']}),
+              (4, 'state', {'state': 'active'})]
+    path.write_text(''.join(
+        json.dumps({'version': version, 'kind': kind, 'data': data}) + '\n'
+        for version, kind, data in events))
+
+    state = recover(path)
+    assert state['version'] == 4
+    assert state['is_active'] == 'active'
+    assert state['players'] == {'a': TANK, 'b': DPS | SUPPORT}
+
+
+def test_torn_last_line_is_cut_off(tmp_path):
+    path = tmp_path / 'queue.jsonl'
+    run(path, lambda queue: [queue.join('a', TANK), queue.join('b', DPS)])
+    with open(path, 'a') as f:
+        f.write('{"version": 3, "kind": "join", "data": {"userna')
+
+    state = recover(path)
+    assert state['version'] == 2
+    assert state['players'] == {'a': TANK, 'b': DPS}
+
+    # New lines start where the last complete one ended
+    run(path, lambda queue: queue.join('c', SUPPORT))
+    state = recover(path)
+    assert state['version'] == 3
+    assert state['players'] == {'a': TANK, 'b': DPS, 'c': SUPPORT}
+
+
+def test_one_bot_at_a_time_owns_a_journal(tmp_path):
+    path = str(tmp_path / 'queue.jsonl')
+    owner = QueueJournal(path)
+    owner.recover()
+    with pytest.raises(RuntimeError):
+        QueueJournal(path).recover()
+    owner.stop()
+    QueueJournal(path).recover()
@@ -0,0 +1,65 @@
+import pytest
+
+from src.bot import priority_cache
+from src.bot.database import (initialize_priority_database, load_priorities,
+                              store_priorities)
+from src.bot.priority_cache import PriorityCache
+
+
+@pytest.fixture
+def reads(temporary_database, monkeypatch):
+    """Nicknames of every load_priorities call the cache makes"""
+    initialize_priority_database()
+    calls = []
+
+    def counting_load(names):
+        names = list(names)
+        calls.append(names)
+        return load_priorities(names)
+
+    monkeypatch.setattr(priority_cache, 'load_priorities', counting_load)
+    return calls
+
+
+def test_misses_are_read_in_one_query(reads):
+    store_priorities([('a', 3, 10)])
+    cache = PriorityCache()
+    priorities = cache.increment_and_get(['a', 'b', 'c'])
+    assert priorities == {'a': (4, 10), 'b': (1, 0), 'c': (1, 0)}
+    assert len(reads) == 1
+    cache.increment(['a', 'b'])
+    assert len(reads) == 1
+
+
+def test_changes_reach_sqlite_on_flush(reads):
+    cache = PriorityCache()
+    cache.increment(['a', 'b'])
+    cache.reset(['b'], timestamp=99)
+    assert load_priorities(['a', 'b']) == {}
+    assert cache.flush() == 2
+    assert load_priorities(['a', 'b']) == {'a': (1, 0), 'b': (0, 99)}
+    assert cache.flush() == 0
+
+
+def test_eviction_spares_the_players_of_the_call(reads):
+    cache = PriorityCache(max_size=2)
+    cache.load(['a', 'b', 'c', 'd'])
+    assert len(cache) == 4
+    assert len(reads) == 1
+    # Everyone was loaded already, incrementing them reads nothing
+    cache.increment_and_get(['a', 'b', 'c', 'd'])
+    assert len(reads) == 1
+    cache.increment(['x'])
+    assert len(cache) == 2
+
+
+def test_evicted_changes_survive_until_flushed(reads):
+    cache = PriorityCache(max_size=1)
+    store_priorities([('a', 5, 0)])
+    cache.increment(['a'])
+    cache.increment(['b'])
+    # a was pushed out with an unflushed change, loading must not undo it
+    cache.load(['a'])
+    assert cache.get_many(['a']) == {'a': (6, 0)}
+    cache.flush()
+    assert load_priorities(['a'])['a'] == (6, 0)
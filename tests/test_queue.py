@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from src.bot.queue import (ALL_ROLES, DPS, SUPPORT, TANK, Queue,
+                           fill_shortfall, lobbies_available)
+from src.bot.role_assignment import assign_roles
+
+
+def mask_counts(masks):
+    counts = [0] * (ALL_ROLES + 1)
+    for mask in masks:
+        counts[mask] += 1
+    return tuple(counts)
+
+
+def test_fill_shortfall_names_the_short_role_set():
+    # Two tanks are queued, but one of them is the only support as well
+    counts = mask_counts([TANK, TANK | SUPPORT, DPS, DPS])
+    needed = {'tank': 2, 'dps': 2, 'support': 1}
+    assert fill_shortfall(counts, needed) == (TANK | SUPPORT, 1)
+    assert fill_shortfall(counts, {'tank': 1, 'dps': 2, 'support': 1}) == (0, 0)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_can_fill_agrees_with_role_assignment(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        queue = Queue()
+        for i in range(rng.randint(0, 14)):
+            queue.join(f'p{i}', rng.randint(1, ALL_ROLES))
+        needed = {'tank': rng.randint(0, 4), 'dps': rng.randint(0, 5),
+                  'support': rng.randint(0, 5)}
+        if not any(needed.values()):
+            continue
+        queued = {'tank': set(queue.tank), 'dps': set(queue.dps),
+                  'support': set(queue.support)}
+        candidates = sorted(queued['tank'] | queued['dps'] | queued['support'])
+        assigned = assign_roles(queued, needed, candidates)
+        assert queue.can_fill(needed) == (assigned is not None)
+        queue.publish()
+        assert queue.snapshot.can_fill(needed) == queue.can_fill(needed)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lobbies_available_is_the_most_that_fit(seed):
+    rng = random.Random(seed)
+    per_lobby = {'tank': 2, 'dps': 4, 'support': 4}
+    for _ in range(200):
+        counts = mask_counts(rng.randint(1, ALL_ROLES)
+                             for _ in range(rng.randint(0, 60)))
+        lobbies = lobbies_available(counts, per_lobby)
+        fits = {role: slots * lobbies for role, slots in per_lobby.items()}
+        more = {role: slots * (lobbies + 1)
+                for role, slots in per_lobby.items()}
+        assert fill_shortfall(counts, fits)[1] == 0
+        assert fill_shortfall(counts, more)[1] > 0
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from src.bot import database
+from src.bot.game_log import Game
+from src.bot.ratings import rate_game, recompute_ratings, replay_ratings
+
+
+@pytest.fixture
+def rating_tables(temporary_database):
+    database.initialize_elo_database()
+    database.initialize_history_database()
+
+
+def random_game(rng, number, players, winner):
+    names = rng.sample(players, 10)
+    game = Game(*names, team_1_captain=names[0], team_2_captain=names[1],
+                winner=winner)
+    # Game stamps itself with the current second
+    game.game_id = f'game{number:03d}'
+    game.timestamp = f'20261018-00{number:02d}00'
+    return game
+
+
+def test_replay_matches_live_updates(rating_tables):
+    rng = random.Random(4)
+    players = [f'player{i}' for i in range(25)]
+    for number in range(60):
+        # Every tenth game was never finished
+        winner = None if number % 10 == 3 else rng.choice(('team1', 'team2'))
+        game = random_game(rng, number, players, winner)
+        rate_game(game)
+        database.record_game(game)
+
+    live = database.load_ratings(players)
+    replayed = {row[0]: row[1:4]
+                for row in replay_ratings(database.load_rating_history())}
+    assert set(replayed) == set(live)
+    for nickname, (elo, peak_elo, games_played) in replayed.items():
+        assert elo == pytest.approx(live[nickname][0])
+        assert peak_elo == pytest.approx(live[nickname][1])
+        assert games_played == live[nickname][2]
+
+
+def test_games_without_a_winner_are_not_rated():
+    rows = [('g1', 't1', name, 'team1' if i < 5 else 'team2', 0)
+            for i, name in enumerate('abcdefghij')]
+    assert replay_ratings(rows) == []
+
+
+def test_recompute_keeps_ratings_without_history(rating_tables):
+    database.store_ratings([('viewer', 1600.0, 1600.0, 3, 't', 16.0)])
+    assert recompute_ratings() == 0
+    assert database.load_ratings(['viewer'])['viewer'][0] == 1600.0
@@ -0,0 +1,78 @@
+import asyncio
+import random
+
+from src.bot.queue import ALL_ROLES, DPS, SUPPORT, TANK
+from src.bot.sampling import weighted_order
+
+
+def fill_queue(bot, players=40, rng_seed=7):
+    rng = random.Random(rng_seed)
+    for i in range(players):
+        bot.queue.join(f'player{i}', rng.randint(1, ALL_ROLES))
+
+
+def pick(bot, lobby_count=1):
+    return asyncio.run(bot._select_lobbies(lobby_count))
+
+
+def test_weighted_order_is_reproducible_with_a_seed():
+    items = [f'p{i}' for i in range(100)]
+    weights = [i + 1 for i in range(100)]
+    first = list(weighted_order(items, weights, random.Random(3)))
+    second = list(weighted_order(items, weights, random.Random(3)))
+    assert first == second
+    assert sorted(first) == sorted(items)
+
+
+def test_seeded_pick_is_reproducible(make_bot):
+    picks = []
+    for _ in range(2):
+        bot = make_bot(seed=11)
+        fill_queue(bot)
+        picks.append(pick(bot, lobby_count=2))
+    assert picks[0]
+    assert picks[0] == picks[1]
+
+
+def test_pick_seats_queued_players_in_their_roles_once(make_bot):
+    bot = make_bot(seed=5)
+    fill_queue(bot)
+    queued = {'tank': set(bot.queue.tank), 'dps': set(bot.queue.dps),
+              'support': set(bot.queue.support)}
+    lobbies = pick(bot, lobby_count=2)
+    assert len(lobbies) == 2
+
+    seated = []
+    for (team_1, team_2, captain_1, captain_2), _ in lobbies:
+        for team in (team_1, team_2):
+            assert {role: len(players) for role, players in team.items()} == {
+                'tank': 1, 'dps': 2, 'support': 2}
+            for role, players in team.items():
+                assert set(players) <= queued[role]
+                seated.extend(players)
+        assert captain_1 in {p for players in team_1.values() for p in players}
+        assert captain_2 in {p for players in team_2.values() for p in players}
+    assert len(seated) == len(set(seated)) == 20
+
+
+def test_concurrent_picks_do_not_share_players(make_bot):
+    bot = make_bot(seed=2)
+    fill_queue(bot)
+
+    async def both():
+        return await asyncio.gather(bot._generate_lobbies(lobby_count=1),
+                                    bot._cmd_pick())
+
+    (games, message), _ = asyncio.run(both())
+    assert len(games) == 1
+    assert len(bot.games) == 1
+    assert not bot.picking
+
+
+def test_failed_pick_still_counts_as_time_queued(make_bot):
+    bot = make_bot(seed=1)
+    bot.queue.join('only_tank', TANK)
+    bot.queue.join('only_dps', DPS | SUPPORT)
+    assert pick(bot) == []
+    assert bot.priorities.get_many(['only_tank'])['only_tank'][0] == 1
+